@@ -3,10 +3,28 @@ import datetime
 import time
 import os
 import json
+import io
 from supabase import create_client
 from groq import Groq
 from PyPDF2 import PdfReader
 import graphviz
+from jobs import JobManager, TooManyJobs, PENDING, RUNNING, DONE, FAILED, in_job_thread
+from semantic_cache import SemanticCache, SEMANTIC_CACHE_FEATURES
+from doc_library import DocumentLibrary, LocalDocumentStore, SupabaseDocumentStore, context_for
+from profiler import make_profiler
+from scheduler import Scheduler, LANE_INTERACTIVE, LANE_BULK, QUEUED, REJECTED, EXPIRED
+from scheduler import FAILED as MODEL_FAILED
+from quiz_engine import QuizSession
+from prompts import (DEFAULT_SYSTEM_ROLE, JSON_SYSTEM_ROLE, EXPLAIN_PROMPT, REVISION_PROMPT, OUTCOMES_PROMPT,
+                     FLASHCARDS_PROMPT, QUIZ_PROMPT, EXPLAIN_LEVELS)
+from llm import make_groq_backend
+from response_store import ResponseStore
+from state_store import LocalStateStore, SupabaseStateStore, LocalStatsStore, SupabaseStatsStore
+from progression import LEVELS, level_for, level_name, badge_mask, badge_names
+from outbox import Outbox, OutboxFlusher, AWARD_XP, SUBMIT_QUIZ, project_stats
+from topic_bundle import BundleCache, BUNDLE_LEVEL, STORED_ARTIFACTS, TOKENS_PER_ARTIFACT, bundle_prompt, parse_bundle
+from chat_store import ChatTranscript, LocalChatStore, SupabaseChatStore
+from mindmap import MindMap, TREE_PROMPT, EXPAND_PROMPT, MAX_CHILDREN, parse_tree, parse_children, normalize_tree
 
 def make_pwa_ready():
     # 1. Meta Tags for PWA-like behavior (Standalone Mode)
@@ -48,7 +66,29 @@ except FileNotFoundError:
     st.error("Secrets not found. Please set up .streamlit/secrets.toml")
     st.stop()
 
+# Storage backends. Chat transcripts and the document library follow the state
+# store unless set explicitly: persisted session state (e.g. the open chat
+# conversation) must point at data every replica can read, so local chat/doc
+# storage is refused when state lives in Supabase.
+STATE_STORE_BACKEND = st.secrets.get("STATE_STORE_BACKEND", "supabase")
+CHAT_STORE_BACKEND = st.secrets.get("CHAT_STORE_BACKEND", STATE_STORE_BACKEND)
+DOC_LIBRARY_BACKEND = st.secrets.get("DOC_LIBRARY_BACKEND", STATE_STORE_BACKEND)
+if STATE_STORE_BACKEND == "supabase" and "local" in (CHAT_STORE_BACKEND, DOC_LIBRARY_BACKEND):
+    st.error("CHAT_STORE_BACKEND and DOC_LIBRARY_BACKEND can't be \"local\" while STATE_STORE_BACKEND is "
+             "\"supabase\" (set all three to \"local\" for a single-machine setup)")
+    st.stop()
+
+# The XP outbox replays every user's progress from a background thread, which
+# needs the service role (see outbox.py). Not needed with STATE_STORE_BACKEND = "local".
+SUPABASE_SERVICE_ROLE_KEY = st.secrets.get("SUPABASE_SERVICE_ROLE_KEY")
+if STATE_STORE_BACKEND != "local" and not SUPABASE_SERVICE_ROLE_KEY:
+    st.error("SUPABASE_SERVICE_ROLE_KEY is missing from .streamlit/secrets.toml (needed to sync XP and streaks)")
+    st.stop()
+
 # Initialize Clients
+# Note: the job pool (JobManager), the ResponseStore and the topic BundleCache are
+# per server process. Answers and job results aren't shared between replicas:
+# a job's result is only picked up by sessions on the replica that ran it.
 @st.cache_resource
 def init_supabase():
     return create_client(SUPABASE_URL, SUPABASE_KEY)
@@ -57,8 +97,84 @@ def init_supabase():
 def init_groq():
     return Groq(api_key=GROQ_API_KEY)
 
+@st.cache_resource
+def init_jobs():
+    # One worker pool per server process, shared by every session
+    return JobManager(max_workers=4, max_jobs_per_user=2)
+
+@st.cache_resource
+def init_response_store():
+    # Persistent answers shared with the warm-up CLI (python warmup.py --help)
+    return ResponseStore()
+
+@st.cache_resource
+def init_semantic_cache():
+    # Shared across users: an explanation of a topic doesn't depend on who asked.
+    # Seeded with the newest stored answers so near-matches work after a restart.
+    cache = SemanticCache(features=SEMANTIC_CACHE_FEATURES, max_entries=2000)
+    for feature, variant, topic, value in reversed(init_response_store().recent(list(SEMANTIC_CACHE_FEATURES), 2000)):
+        cache.put(feature, topic, value, variant)
+    return cache
+
+@st.cache_resource
+def init_bundle_cache():
+    # Per-user/topic artifacts prefetched by generate_bundle()
+    return BundleCache(max_topics=5000)
+
+@st.cache_resource
+def init_doc_library():
+    # Shared across servers with the "supabase" backend (the default unless state is local)
+    if DOC_LIBRARY_BACKEND == "supabase":
+        return DocumentLibrary(SupabaseDocumentStore(init_supabase()))
+    return DocumentLibrary(LocalDocumentStore())
+
+@st.cache_resource
+def init_chat_store():
+    # Transcripts in Supabase (the default unless state is local) or a local SQLite file
+    if CHAT_STORE_BACKEND == "supabase":
+        return SupabaseChatStore(init_supabase())
+    return LocalChatStore()
+
+@st.cache_resource
+def init_state_stores():
+    # Session state and XP live outside the process so any replica can serve any
+    # request. STATE_STORE_BACKEND = "local" uses SQLite (tests / single machine).
+    if STATE_STORE_BACKEND == "local":
+        return LocalStateStore(), LocalStatsStore()
+    return SupabaseStateStore(init_supabase()), SupabaseStatsStore(init_supabase())
+
+@st.cache_resource
+def init_outbox():
+    # Gamification writes are logged locally first and replayed in the background
+    # (see outbox.py). The flusher replays for every user of this server, so it gets
+    # its own client with the service role key.
+    stats = init_state_stores()[1]
+    if isinstance(stats, SupabaseStatsStore):
+        stats = SupabaseStatsStore(create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY))
+    outbox = Outbox()
+    return outbox, OutboxFlusher(outbox, stats.replay).start()
+
+@st.cache_resource
+def init_profiler():
+    # Off unless STUDY_BUDDY_PROFILE=timing|cprofile is set (see profiler.py)
+    return make_profiler()
+
+@st.cache_resource
+def init_scheduler():
+    # All model calls go through the fair scheduler (see scheduler.py)
+    return Scheduler(make_groq_backend(init_groq()), workers=4, max_queue=64, rate_per_min=6.0, burst=12.0)
+
 supabase = init_supabase()
-groq_client = init_groq()
+state_store, stats_store = init_state_stores()
+outbox, outbox_flusher = init_outbox()
+model_scheduler = init_scheduler()
+profiler = init_profiler()
+job_manager = init_jobs()
+response_store = init_response_store()
+semantic_cache = init_semantic_cache()
+bundle_cache = init_bundle_cache()
+doc_library = init_doc_library()
+chat_store = init_chat_store()
 
 # ==========================================
 # 2. SESSION STATE MANAGEMENT
@@ -71,11 +187,13 @@ def init_session_state():
         "xp": 0,
         "streak": 0,
         "last_study_date": None,
-        "chat_history": [],
-        "quiz_data": [],      # Stores the current active quiz
-        "quiz_answers": {},   # Stores user answers
+        "stats_stale": False, # True when the last stats read failed (numbers come from the session)
+        "chat": None,         # ChatTranscript: only the latest page of messages
+        "chat_conversation_id": None,
+        "quiz": None,         # Active QuizSession (answers are recorded inside it)
         "study_timer_active": False,
-        "study_start_time": None
+        "study_start_time": None,
+        "jobs": {}            # feature kind -> background job id
     }
     for key, value in defaults.items():
         if key not in st.session_state:
@@ -90,20 +208,129 @@ def go_to(page):
 # ==========================================
 # 3. BACKEND HELPERS (AI, Auth, DB)
 # ==========================================
-def ask_ai(prompt, system_role="You are a helpful AI tutor."):
+BUSY_MESSAGE = "⏳ Study Buddy is very busy right now. Please try again in a minute."
+QUEUED_MESSAGE = "⏳ Your request is still waiting in the queue. Please try again in a moment."
+DEGRADED_NOTE = "\n\n_⚡ Short answer mode: you've made a lot of requests recently, so this one was kept brief._"
+
+# How long a page waits for its request to start before giving up on it
+PAGE_WAIT_SECONDS = 60
+
+def ask_ai(prompt, system_role=DEFAULT_SYSTEM_ROLE, lane=LANE_INTERACTIVE, user_id=None, max_tokens=1500,
+           speculative=False):
+    # Background jobs pass user_id explicitly (they can't touch st.*) and may use the
+    # bulk lane. Calls made on the page always take the interactive lane (bulk work can
+    # be deferred for a long time), show live queue status while waiting, and give up
+    # on a request that hasn't started after PAGE_WAIT_SECONDS.
+    # speculative calls (prefetches) are billed to the shared prefetch budget, not the user's.
+    on_page = not in_job_thread()
+    if on_page:
+        user_id = user_id or st.session_state.get("user_id") or "anonymous"
+        lane = LANE_INTERACTIVE
+    ticket = model_scheduler.submit(user_id, lane, {"prompt": prompt, "system_role": system_role, "max_tokens": max_tokens},
+                                    speculative=speculative)
+
+    if on_page and not ticket.wait(0.5):
+        deadline = time.monotonic() + PAGE_WAIT_SECONDS
+        status = st.empty()
+        while not ticket.wait(1):
+            if ticket.status == QUEUED:
+                # Still not started: drop it from the queue rather than keep the page hanging
+                if time.monotonic() >= deadline and model_scheduler.cancel(ticket):
+                    break
+                status.info(f"🕒 Queued: {model_scheduler.position(ticket)} request(s) ahead of you...")
+            else:
+                status.empty()
+        status.empty()
+    ticket.wait()
+
+    if ticket.status == REJECTED:
+        return BUSY_MESSAGE
+    if ticket.status == EXPIRED:
+        return QUEUED_MESSAGE
+    if ticket.status == MODEL_FAILED:
+        return f"AI Error: {ticket.error}"
+    if ticket.degraded:
+        return ticket.result + DEGRADED_NOTE
+    return ticket.result
+
+def is_cacheable(res):
+    # Don't keep errors, "busy"/"queued" replies or shortened answers around
+    return not (res.startswith("AI Error") or res in (BUSY_MESSAGE, QUEUED_MESSAGE) or res.endswith(DEGRADED_NOTE))
+
+def ask_ai_cached(feature, topic, prompt, variant=""):
+    # Topic-based features reuse answers for the same or a near-identical topic.
+    # variant holds any other option that changes the answer (e.g. the level).
+    cached, kind = semantic_cache.get(feature, topic, variant)
+    if cached is not None:
+        if kind == "near":
+            st.caption("♻️ Reused an answer for a very similar topic.")
+        return cached
+    # Answers written since startup (e.g. by the warm-up CLI)
+    stored = response_store.get(feature, topic, variant)
+    if stored is not None:
+        semantic_cache.put(feature, topic, stored, variant)
+        return stored
+    res = ask_ai(prompt)
+    if is_cacheable(res):
+        semantic_cache.put(feature, topic, res, variant)
+        response_store.put(feature, topic, res, variant)
+    return res
+
+# --- TOPIC BUNDLES ---
+def generate_bundle(topic, user_id, artifacts):
+    # Runs in a background job: the missing topic artifacts in one structured call.
+    # A failed or incomplete answer is recorded so the prefetch backs off.
+    ok = False
     try:
-        completion = groq_client.chat.completions.create(
-            model="llama-3.1-8b-instant",
-            messages=[
-                {"role": "system", "content": system_role},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            max_tokens=1500
-        )
-        return completion.choices[0].message.content
-    except Exception as e:
-        return f"AI Error: {str(e)}"
+        response = ask_ai(bundle_prompt(topic, artifacts), system_role=JSON_SYSTEM_ROLE, lane=LANE_BULK,
+                          user_id=user_id, max_tokens=TOKENS_PER_ARTIFACT * len(artifacts), speculative=True)
+        bundle = parse_bundle(response, topic)
+        bundle_cache.put(user_id, topic, bundle)
+        ok = all(a in bundle for a in artifacts)
+    finally:
+        bundle_cache.finish_prefetch(user_id, topic, ok)
+
+def is_stored(artifact, topic):
+    # True if the shared response store already answers this artifact for the topic
+    if artifact not in STORED_ARTIFACTS:
+        return False
+    feature, variant = STORED_ARTIFACTS[artifact]
+    return response_store.get(feature, topic, variant) is not None
+
+def prefetch_bundle(topic, have=None):
+    # Keep what we just generated and fetch the rest of the topic bundle in the background
+    user_id = st.session_state.user_id
+    if not topic.strip(): return
+    if have:
+        bundle_cache.put(user_id, topic, have)
+    # Only what the student doesn't have and the shared response store (warm-up,
+    # other students) doesn't already answer
+    missing = [a for a in bundle_cache.missing(user_id, topic) if not is_stored(a, topic)]
+    if not missing:
+        return
+    # Speculative work only runs on spare budget: never while the student is short themselves
+    if not model_scheduler.can_prefetch(user_id, cost=TOKENS_PER_ARTIFACT * len(missing) / 1000):
+        return
+    if bundle_cache.start_prefetch(user_id, topic):
+        # One prefetch per student: this one replaces a queued prefetch for an older topic,
+        # and is skipped while another is already running
+        try:
+            job_manager.submit_speculative(user_id, "bundle", generate_bundle, topic, user_id, missing,
+                                           on_drop=lambda: bundle_cache.finish_prefetch(user_id, topic))
+        except TooManyJobs:
+            bundle_cache.finish_prefetch(user_id, topic)
+
+def ask_ai_for_topic(artifact, topic, generate):
+    # Topic features check the student's prefetched bundle before calling the model
+    cached = bundle_cache.get(st.session_state.user_id, topic, artifact)
+    if cached is not None:
+        st.caption("⚡ Ready from your topic bundle.")
+        return cached
+    res = generate()
+    if is_cacheable(res):
+        prefetch_bundle(topic, {artifact: res})
+    return res
+
 def extract_text_from_pdf(uploaded_file):
     try:
         pdf_reader = PdfReader(uploaded_file)
@@ -113,6 +340,73 @@ def extract_text_from_pdf(uploaded_file):
         return text
     except Exception as e:
         return None
+
+def pick_document(key):
+    # Upload a PDF (parsed once, then kept in the user's library) or reopen one
+    # from the library without any PDF parsing. Returns the document or None.
+    user_id = st.session_state.user_id
+    uploaded_file = st.file_uploader("Upload a new PDF", type=['pdf'], key=f"{key}_uploader")
+    if uploaded_file is not None:
+        with st.spinner("Reading PDF..."):
+            doc = doc_library.add(user_id, uploaded_file.name, uploaded_file.getvalue(),
+                                  lambda data: extract_text_from_pdf(io.BytesIO(data)))
+        if doc is None:
+            st.error("Could not extract text from PDF.")
+        return doc
+
+    docs = {d["doc_hash"]: d for d in doc_library.list(user_id)}
+    if docs:
+        choice = st.selectbox(
+            "...or open one from your library", [None] + list(docs), key=f"{key}_library",
+            format_func=lambda h: "—" if h is None else f"📄 {docs[h]['name']} ({docs[h]['chars']:,} chars)"
+        )
+        if choice:
+            return doc_library.load(user_id, choice)
+    return None
+
+# --- BACKGROUND JOBS ---
+def start_job(kind, fn, *args, **kwargs):
+    # Hand slow AI work to the worker pool. fn runs off the script thread,
+    # so it must not call st.* (award XP when the result is collected instead).
+    try:
+        job_id = job_manager.submit(st.session_state.user_id, kind, fn, *args, **kwargs)
+        st.session_state.jobs[kind] = job_id
+    except TooManyJobs as e:
+        st.warning(str(e))
+
+@st.fragment(run_every=1)
+def show_job_status(job_id, waiting_text):
+    # Only this fragment redraws (every second) while the job is in flight; the
+    # rest of the page isn't rerun. Once the job is finished, one full rerun
+    # lets the feature show its result.
+    job = job_manager.get(job_id)
+    if job is None or job["status"] not in (PENDING, RUNNING):
+        st.rerun()
+    if job["status"] == PENDING:
+        st.info(f"🕒 Queued... ({job_manager.queue_depth()} task(s) waiting)")
+    else:
+        st.info(f"⏳ {waiting_text}")
+
+def poll_job(kind, waiting_text="Working on it..."):
+    # Returns the job for this feature (or None); callers use it once it is DONE.
+    # While it is still queued/running a self-refreshing status box is shown.
+    job_id = st.session_state.jobs.get(kind)
+    job = job_manager.get(job_id) if job_id else None
+    if job is None:
+        # Reconnected or new session: pick up this user's latest job of this kind
+        job = job_manager.latest(st.session_state.user_id, kind)
+        if job is None: return None
+        st.session_state.jobs[kind] = job["id"]
+
+    if job["status"] in (PENDING, RUNNING):
+        show_job_status(job["id"], waiting_text)
+    elif job["status"] == FAILED:
+        # Show the failure once, then drop it so the next visit starts clean
+        st.error(f"Task failed: {job['error']}")
+        job_manager.forget(job["id"])
+        st.session_state.jobs.pop(kind, None)
+    return job
+
 # --- AUTHENTICATION ---
 def login_user(email, password):
     try:
@@ -120,6 +414,7 @@ def login_user(email, password):
         st.session_state.user = response.user
         st.session_state.user_id = response.user.id
         sync_user_stats(response.user.id)
+        restore_state(response.user.id)
         st.success("Login successful!")
         time.sleep(1)
         st.rerun()
@@ -131,11 +426,12 @@ def signup_user(email, password):
         response = supabase.auth.sign_up({"email": email, "password": password})
         if response.user:
             # FIX: Removed 'level' because it doesn't exist in your DB
-            supabase.table("user_stats").insert({
+            # One row per user (unique user_id): keep the row if the first XP write got there first
+            supabase.table("user_stats").upsert({
                 "user_id": response.user.id,
                 "xp": 0,
                 "streak": 0
-            }).execute()
+            }, on_conflict="user_id", ignore_duplicates=True).execute()
             st.success("✅ Account created! Please check your email to verify your account before logging in.")
     except Exception as e:
         # Check if it's actually a success but hidden in a weird response
@@ -150,52 +446,88 @@ def logout_user():
     st.rerun()
 
 # --- GAMIFICATION & DB SYNC ---
+def apply_stats(stats):
+    # Session copies of XP/streak are display caches; the stats store is the truth
+    if stats:
+        st.session_state.xp = stats.get('xp', 0)
+        st.session_state.streak = stats.get('streak', 0)
+        st.session_state.last_study_date = stats.get('last_study_date')
+
 def sync_user_stats(user_id):
+    # Server stats plus this user's writes still waiting in the outbox. If the
+    # server can't be reached, keep showing the session's numbers.
+    try:
+        stats = stats_store.get_stats(user_id)
+        st.session_state.stats_stale = False
+    except Exception as e:
+        st.session_state.stats_stale = True
+        return
+    apply_stats(project_stats(stats, outbox.pending(user_id)))
+
+def queue_write(kind, payload):
+    # Durable local append, acknowledged at once; the flusher replays it upstream
+    # as an atomic increment (+ streak + study log), never an absolute write
     try:
-        data = supabase.table("user_stats").select("*").eq("user_id", user_id).execute()
-        if data.data:
-            stats = data.data[0]
-            st.session_state.xp = stats.get('xp', 0)
-            st.session_state.streak = stats.get('streak', 0)
-            st.session_state.last_study_date = stats.get('last_study_date')
+        outbox.append(st.session_state.user_id, kind, payload)
     except Exception as e:
-        pass
+        st.error(f"Could not save your progress: {e}")
+        return False
+    current = {"xp": st.session_state.xp, "streak": st.session_state.streak,
+               "last_study_date": st.session_state.last_study_date}
+    apply_stats(project_stats(current, [{"kind": kind, "payload": payload}]))
+    outbox_flusher.wake()
+    return True
 
 def add_xp(amount, activity_name):
     if not st.session_state.user_id: return
-    st.session_state.xp += amount
-    try:
-        supabase.table("user_stats").update({"xp": st.session_state.xp}).eq("user_id", st.session_state.user_id).execute()
-        supabase.table("study_logs").insert({
-            "user_id": st.session_state.user_id,
-            "minutes": 10, 
-            "activity_type": activity_name,
-            "date": str(datetime.date.today())
-        }).execute()
+    payload = {"amount": amount, "activity": activity_name, "minutes": 10, "day": str(datetime.date.today())}
+    if queue_write(AWARD_XP, payload):
         st.toast(f"🎉 +{amount} XP for {activity_name}!", icon="⭐")
-        update_streak()
+
+def commit_quiz(quiz):
+    # Score the whole quiz; XP, streak, study log and attempt are ONE outbox write.
+    # Returns False (quiz left open, error shown) if the write couldn't be saved.
+    params = quiz.submit(st.session_state.user_id)
+    if not st.session_state.user_id: return True
+    if not queue_write(SUBMIT_QUIZ, params):
+        quiz.reopen()
+        return False
+    st.toast(f"🎉 +{params['p_xp']} XP for your quiz!", icon="⭐")
+    save_state("quiz")
+    return True
+
+# --- SHARED SESSION STATE ---
+PERSISTED_STATE = ("quiz", "timer_state", "chat_conversation_id")
+
+def save_state(key):
+    # Write one piece of session state through to the shared store, so another
+    # tab or app replica can pick it up
+    user_id = st.session_state.user_id
+    if not user_id: return
+    value = st.session_state.get(key)
+    if key == "quiz" and value is not None:
+        value = value.to_dict()
+    try:
+        if value is None:
+            state_store.delete(user_id, key)
+        else:
+            state_store.set(user_id, key, value)
     except Exception as e:
-        st.error(f"Sync Error: {e}")
+        st.warning(f"Could not save your progress: {e}")
 
-def update_streak():
-    if not st.session_state.user_id: return
-    today = str(datetime.date.today())
-    if st.session_state.last_study_date == today: return
-    
-    new_streak = 1
-    if st.session_state.last_study_date:
-        last_obj = datetime.datetime.strptime(st.session_state.last_study_date, "%Y-%m-%d").date()
-        if (datetime.date.today() - last_obj).days == 1:
-            new_streak = st.session_state.streak + 1
-            
-    supabase.table("user_stats").update({"streak": new_streak, "last_study_date": today}).eq("user_id", st.session_state.user_id).execute()
-    st.session_state.streak = new_streak
-    st.session_state.last_study_date = today
+def restore_state(user_id):
+    try:
+        saved = state_store.get_many(user_id, PERSISTED_STATE)
+    except Exception as e:
+        return
+    for key, value in saved.items():
+        st.session_state[key] = QuizSession.from_dict(value) if key == "quiz" else value
 
 # ==========================================
 # 4. FEATURE RENDERERS
 # ==========================================
 
+@profiler.timed
 def render_home():
     st.title(f"👋 Welcome Back!")
     
@@ -203,8 +535,7 @@ def render_home():
     c1, c2, c3 = st.columns(3)
     c1.metric("⭐ Total XP", st.session_state.xp)
     c2.metric("🔥 Streak", f"{st.session_state.streak} Days")
-    level = "Master" if st.session_state.xp > 500 else "Intermediate" if st.session_state.xp > 200 else "Beginner"
-    c3.metric("🏆 Rank", level)
+    c3.metric("🏆 Rank", level_for(st.session_state.xp)[1])
     
     st.divider()
     st.markdown("### 🚀 Quick Access")
@@ -220,6 +551,7 @@ def render_home():
         st.button("💬 Chat with AI", use_container_width=True, on_click=go_to, args=("💬 Chat with AI",))
         st.button("🗺️ Study Roadmap", use_container_width=True, on_click=go_to, args=("🗺️ Study Roadmap",))
 
+@profiler.timed
 def render_quiz():
     st.header("❓ Interactive Quiz Generator")
     col1, col2 = st.columns([3, 1])
@@ -229,44 +561,81 @@ def render_quiz():
         num_q = st.number_input("No. of Questions", min_value=1, max_value=10, value=3)
     
     if st.button("Generate Quiz"):
-        with st.spinner("Generating Interactive Quiz..."):
-            # Prompt asking for JSON format for easier parsing
-            prompt = (f"Create {num_q} multiple choice questions about {topic}. "
-                      "Output ONLY valid JSON format like this: "
-                      "[{'question': '...', 'options': ['A', 'B', 'C', 'D'], 'correct': 'Option Text'}, ...]")
-            try:
-                response = ask_ai(prompt, system_role="You are a strict JSON generator.")
-                # Basic cleanup to ensure we find the JSON list
-                start = response.find('[')
-                end = response.rfind(']') + 1
-                json_str = response[start:end]
-                st.session_state.quiz_data = json.loads(json_str)
-                st.session_state.quiz_answers = {} # Reset answers
-            except:
-                st.error("AI failed to generate valid JSON. Please try again.")
-
-    # Render the Quiz if data exists
-    if st.session_state.quiz_data:
-        st.markdown("---")
-        for i, q in enumerate(st.session_state.quiz_data):
-            st.subheader(f"Q{i+1}: {q['question']}")
-            # Use a unique key for each radio button based on index
-            choice = st.radio(f"Select Answer for Q{i+1}", q['options'], key=f"q_{i}")
-            
-            # Check Answer Button
-            if st.button(f"Check Answer {i+1}", key=f"btn_{i}"):
-                if choice == q['correct']:
-                    st.success("✅ Correct!")
-                    add_xp(10, "Correct Answer")
+        # Questions may already have been prefetched (topic bundle) or pre-generated (warm-up)
+        ready = QuizSession.from_ai(topic, bundle_cache.get(st.session_state.user_id, topic, "quiz"))
+        source = "⚡ Ready from your topic bundle."
+        if len(ready) < num_q:
+            ready = QuizSession.from_ai(topic, response_store.get("quiz", topic))
+            source = "📦 Ready from previously generated questions."
+        if len(ready) >= num_q:
+            st.session_state.quiz = QuizSession(topic, ready.questions[:num_q])
+            save_state("quiz")
+            st.caption(source)
+        else:
+            with st.spinner("Generating Interactive Quiz..."):
+                # Prompt asking for JSON format for easier parsing
+                prompt = QUIZ_PROMPT.format(num_q=num_q, topic=topic)
+                response = ask_ai(prompt, system_role=JSON_SYSTEM_ROLE)
+                if response in (BUSY_MESSAGE, QUEUED_MESSAGE):
+                    st.warning(response)
                 else:
-                    st.error(f"❌ Incorrect. The correct answer was: {q['correct']}")
+                    try:
+                        # Basic cleanup to ensure we find the JSON list
+                        start = response.find('[')
+                        end = response.rfind(']') + 1
+                        json_str = response[start:end]
+                        quiz = QuizSession.from_ai(topic, json.loads(json_str))
+                        if len(quiz):
+                            st.session_state.quiz = quiz
+                            save_state("quiz")
+                            prefetch_bundle(topic)
+                        else:
+                            st.error("AI failed to generate valid JSON. Please try again.")
+                    except:
+                        st.error("AI failed to generate valid JSON. Please try again.")
+
+    quiz = st.session_state.quiz
+    if not quiz:
+        return
+    st.markdown("---")
+
+    # Answer everything inside one form: no reruns or DB writes until submission
+    if not quiz.submitted:
+        with st.form(f"quiz_form_{quiz.started_at}"):
+            for i, (question, options, _) in enumerate(quiz.questions):
+                st.subheader(f"Q{i+1}: {question}")
+                choice = st.radio(f"Select Answer for Q{i+1}", range(len(options)), index=quiz.chosen(i),
+                                  format_func=lambda j, options=options: options[j], key=f"quiz_{quiz.started_at}_{i}")
+                quiz.answer(i, choice)
+            # On failure stay on the form so the error stays visible and the quiz can be resubmitted
+            if st.form_submit_button("Submit Quiz") and commit_quiz(quiz):
+                st.rerun()
+        return
+
+    # Results
+    correct = quiz.result["correct"]
+    st.metric("Your Score", f"{correct}/{len(quiz)}", f"+{quiz.result['xp']} XP")
+    for i, (question, options, answer) in enumerate(quiz.questions):
+        st.subheader(f"Q{i+1}: {question}")
+        if quiz.result["marks"][i]:
+            st.success(f"✅ Correct! {options[answer]}")
+        else:
+            picked = quiz.chosen(i)
+            yours = options[picked] if picked is not None else "No answer"
+            st.error(f"❌ You answered: {yours}. The correct answer was: {options[answer]}")
+    if st.button("🔄 New Quiz"):
+        st.session_state.quiz = None
+        save_state("quiz")
+        st.rerun()
 
+@profiler.timed
 def render_flashcards():
     st.header("📚 Flashcards")
     topic = st.text_input("Topic")
     if st.button("Generate Cards"):
         with st.spinner("Creating..."):
-            res = ask_ai(f"Create 5 flashcards for {topic}. Format: Front | Back")
+            res = ask_ai_for_topic("flashcards", topic,
+                lambda: ask_ai_cached("flashcards", topic, FLASHCARDS_PROMPT.format(topic=topic)))
             st.session_state.flashcards = res 
             add_xp(20, "Flashcards")
     
@@ -274,50 +643,102 @@ def render_flashcards():
         st.markdown(st.session_state.flashcards)
 
 
+def generate_mindmap_tree(topic, user_id):
+    # Runs in a background job: one small call for the first two levels of the map,
+    # unless the tree for this topic was already generated (or warmed up)
+    tree = response_store.get("mindmap", topic)
+    if tree is not None:
+        try:
+            return normalize_tree(tree)  # may have been stored before trees were checked node by node
+        except ValueError:
+            pass  # unusable: generate a fresh one below
+    response = ask_ai(TREE_PROMPT.format(topic=topic), system_role=JSON_SYSTEM_ROLE,
+                      lane=LANE_BULK, user_id=user_id)
+    tree = parse_tree(response)
+    response_store.put("mindmap", topic, tree)
+    return tree
+
+@st.cache_data(show_spinner=False, max_entries=2000)
+def expand_mindmap_node(path, _user_id):
+    # One small model call per expansion, shared by everyone who drills into the
+    # same branch. Raises on bad JSON so failures aren't cached.
+    response = ask_ai(
+        EXPAND_PROMPT.format(root=path[0], path=" > ".join(path), label=path[-1], max_children=MAX_CHILDREN),
+        system_role=JSON_SYSTEM_ROLE, user_id=_user_id
+    )
+    return parse_children(response)
+
+@profiler.timed
 def render_mindmap():
     st.header("🧠 AI Mind Map Generator")
     topic = st.text_input("Enter a complex topic (e.g., Photosynthesis)")
     
     if st.button("Generate Mind Map"):
-        with st.spinner("Drawing diagram..."):
-            # 1. Get the DOT code from AI
-            prompt = (f"Create a mind map for '{topic}' using Graphviz DOT language. "
-                      "Output ONLY the DOT code inside a code block. Start with 'digraph G {{'.")
-            dot_code = ask_ai(prompt, system_role="You are a Graphviz expert.")
-            
-            # 2. Clean the code
-            if "```" in dot_code:
-                dot_code = dot_code.split("```")[1]
-                if dot_code.startswith("dot"): dot_code = dot_code[3:]
-            
-            # 3. Render and Display
-            try:
-                # Display on screen
-                st.graphviz_chart(dot_code)
-                
-                # Create downloadable file
-                src = graphviz.Source(dot_code)
-                png_data = src.pipe(format='png')
-                
-                # Download Button
-                st.download_button(
-                    label="📥 Download Mind Map (PNG)",
-                    data=png_data,
-                    file_name=f"{topic}_mindmap.png",
-                    mime="image/png"
-                )
-                
+        start_job("mindmap", generate_mindmap_tree, topic, st.session_state.user_id)
+
+    # A finished job becomes the map we keep in session state and expand locally
+    job = poll_job("mindmap", "Drawing diagram...")
+    if job and job["status"] == DONE and st.session_state.get("mindmap_job") != job["id"]:
+        st.session_state.mindmap_job = job["id"]
+        try:
+            st.session_state.mindmap = MindMap.from_tree(job["result"])
+            if job_manager.claim(job["id"]):
                 add_xp(20, "Mind Map Created")
-            except Exception as e:
-                st.error(f"Could not render diagram. Try a simpler topic. Error: {e}")
+        except Exception as e:
+            st.error(f"AI returned a mind map we couldn't read. Please try again. Error: {e}")
+
+    mm = st.session_state.get("mindmap")
+    if not mm:
+        return
+
+    # Render and Display
+    dot_code = mm.to_dot()
+    try:
+        # Display on screen
+        st.graphviz_chart(dot_code)
+        
+        # Create downloadable file
+        src = graphviz.Source(dot_code)
+        png_data = src.pipe(format='png')
+        
+        # Download Button
+        st.download_button(
+            label="📥 Download Mind Map (PNG)",
+            data=png_data,
+            file_name=f"{mm.root}_mindmap.png",
+            mime="image/png"
+        )
+    except Exception as e:
+        st.error(f"Could not render diagram. Try a simpler topic. Error: {e}")
+
+    # Drill into one branch (dashed boxes haven't been expanded yet)
+    options = mm.expandable()
+    if options:
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            node_id = st.selectbox("🔎 Drill into a branch", options, format_func=lambda i: " › ".join(mm.path(i)))
+        with col2:
+            st.write("")
+            if st.button("➕ Expand", use_container_width=True):
+                with st.spinner("Expanding branch..."):
+                    try:
+                        children = expand_mindmap_node(tuple(mm.path(node_id)), st.session_state.user_id)
+                        mm.expand(node_id, children)
+                        st.rerun()
+                    except ValueError:
+                        st.error("Couldn't expand that branch. Please try again.")
 
+@profiler.timed
 def render_leaderboard():
     st.header("🏆 Global Leaderboard")
     
+    # Optional level filter (stored levels, indexed query)
+    levels = [None] + list(range(len(LEVELS), 0, -1))
+    level = st.selectbox("Level", levels, format_func=lambda l: "All levels" if l is None else level_name(l))
+
     # Fetch top 10 users by XP
     try:
-        response = supabase.table("user_stats").select("*").order("xp", desc=True).limit(10).execute()
-        data = response.data
+        data = stats_store.leaderboard(limit=10, level=level)
         
         if data:
             st.write("See where you stand among other students!")
@@ -328,8 +749,8 @@ def render_leaderboard():
                 # Mask email for privacy (e.g., a***@gmail.com)
                 user_id = student['user_id'] 
                 xp = student['xp']
-                level = student.get('level', 'Beginner')
-                leaderboard_data.append({"Rank": rank+1, "Level": level, "XP": xp})
+                leaderboard_data.append({"Rank": rank+1, "Level": level_for(xp)[1], "XP": xp,
+                                         "Badges": " ".join(b.split()[0] for b in badge_names(badge_mask(xp, student['streak'])))})
                 
             st.dataframe(leaderboard_data, use_container_width=True)
         else:
@@ -338,16 +759,23 @@ def render_leaderboard():
     except Exception as e:
         st.error(f"Could not load leaderboard: {e}")
         
+@profiler.timed
 def render_explain_topic():
     st.header("📘 Explain Topic")
     topic = st.text_input("Enter Topic")
-    level = st.selectbox("Level", ["5-Year Old", "High School", "University"])
+    level = st.selectbox("Level", EXPLAIN_LEVELS)
     if st.button("Explain"):
-        res = ask_ai(f"Explain {topic} at a {level} level.")
+        generate = lambda: ask_ai_cached("explain", topic, EXPLAIN_PROMPT.format(topic=topic, level=level), variant=level)
+        if level == BUNDLE_LEVEL:
+            res = ask_ai_for_topic("explanation", topic, generate)
+        else:
+            res = generate()
+            prefetch_bundle(topic)
         st.markdown(res)
         add_xp(15, "Explanation")
 
 # --- UPDATED SUMMARY WITH PDF UPLOAD ---
+@profiler.timed
 def render_summary():
     st.header("📝 Summarize Notes")
     
@@ -361,27 +789,28 @@ def render_summary():
             notes_text = text_input
 
     with tab2:
-        uploaded_file = st.file_uploader("Upload PDF Notes", type=['pdf'])
-        if uploaded_file is not None:
-            extracted_text = extract_text_from_pdf(uploaded_file)
-            if extracted_text:
-                st.success("PDF Loaded Successfully!")
-                with st.expander("View Extracted Text"):
-                    st.write(extracted_text[:1000] + "...") # Preview
-                notes_text = extracted_text
-            else:
-                st.error("Could not extract text from PDF.")
+        doc = pick_document("summary")
+        if doc:
+            st.success("PDF Loaded Successfully!")
+            with st.expander("View Extracted Text"):
+                st.write(doc["text"][:1000] + "...") # Preview
+            notes_text = doc["text"]
 
     if st.button("Generate Summary"):
         if notes_text:
-            with st.spinner("AI is analyzing your notes..."):
-                # Limit text to prevent token errors (approx 4000 chars)
-                summary = ask_ai(f"Summarize these notes in structured bullet points:\n{notes_text[:12000]}")
-                st.markdown(summary)
-                add_xp(15, "Summary")
+            # Limit text to prevent token errors (approx 4000 chars)
+            start_job("summary", ask_ai, f"Summarize these notes in structured bullet points:\n{notes_text[:12000]}",
+                      lane=LANE_BULK, user_id=st.session_state.user_id)
         else:
             st.warning("Please paste text or upload a PDF first.")
+
+    job = poll_job("summary", "AI is analyzing your notes...")
+    if job and job["status"] == DONE:
+        st.markdown(job["result"])
+        if job_manager.claim(job["id"]):
+            add_xp(15, "Summary")
             
+@profiler.timed
 def render_exam_mode():
     st.header("⏱️ Exam Mode (AI Grader)")
     st.info("The AI will set a question, you answer it, and it will grade you.")
@@ -421,52 +850,94 @@ def render_exam_mode():
                         st.session_state['exam_answer_graded'] = True
             else:
                 st.warning("Please write an answer first.")
+@profiler.timed
 def render_chat():
     st.header("💬 Chat with AI ( & Documents)")
 
-    # --- PDF UPLOADER SECTION ---
-    with st.expander("📂 Upload a PDF to chat with", expanded=False):
-        uploaded_file = st.file_uploader("Upload your PDF here", type=['pdf'], key="chat_pdf_uploader")
-        
-        if uploaded_file:
-            # Check if we already processed this specific file to avoid re-processing on every click
-            if "current_pdf_name" not in st.session_state or st.session_state.current_pdf_name != uploaded_file.name:
-                with st.spinner("Reading PDF..."):
-                    text = extract_text_from_pdf(uploaded_file)
-                    if text:
-                        st.session_state.chat_pdf_content = text
-                        st.session_state.current_pdf_name = uploaded_file.name
-                        st.success("PDF Loaded! The AI can now read this document.")
-                    else:
-                        st.error("Could not read the PDF.")
+    # --- DOCUMENT SECTION ---
+    with st.expander("📂 Chat with a PDF from your library", expanded=False):
+        doc = pick_document("chat")
+        # Only the hash lives in session state; the document is loaded lazily
+        if doc and st.session_state.get("chat_doc_hash") != doc["doc_hash"]:
+            st.session_state.chat_doc_hash = doc["doc_hash"]
+            st.session_state.current_pdf_name = doc["name"]
+            st.success("PDF Loaded! The AI can now read this document.")
         
         # Clear button
-        if "chat_pdf_content" in st.session_state and st.button("Clear PDF Context"):
-            del st.session_state.chat_pdf_content
+        if "chat_doc_hash" in st.session_state and st.button("Clear PDF Context"):
+            del st.session_state.chat_doc_hash
             del st.session_state.current_pdf_name
             st.rerun()
 
     # Show active context indicator
-    if "chat_pdf_content" in st.session_state:
+    if "chat_doc_hash" in st.session_state:
         st.caption(f"✅ Context Active: {st.session_state.current_pdf_name}")
 
+    # --- CONVERSATIONS ---
+    user_id = st.session_state.user_id
+    if "chat_conversations" not in st.session_state:
+        st.session_state.chat_conversations = chat_store.list_conversations(user_id)
+    convs = st.session_state.chat_conversations
+    if st.session_state.chat is None:
+        # Reopen the conversation this user had open (or the most recent one), latest page only
+        conversation_id = st.session_state.chat_conversation_id or (convs[0]["id"] if convs else None)
+        st.session_state.chat = ChatTranscript(chat_store, user_id, conversation_id)
+    chat = st.session_state.chat
+
+    col1, col2 = st.columns([4, 1])
+    with col1:
+        ids = [c["id"] for c in convs]
+        if chat.conversation_id in ids:
+            titles = {c["id"]: c["title"] for c in convs}
+            picked = st.selectbox("Conversation", ids, index=ids.index(chat.conversation_id),
+                                  format_func=titles.get, key=f"chat_conv_{chat.conversation_id}")
+            if picked != chat.conversation_id:
+                chat.flush()
+                st.session_state.chat = ChatTranscript(chat_store, user_id, picked)
+                st.session_state.chat_conversation_id = picked
+                save_state("chat_conversation_id")
+                st.rerun()
+        else:
+            st.caption("🆕 New conversation")
+    with col2:
+        if st.button("➕ New Chat", use_container_width=True):
+            chat.flush()
+            st.session_state.chat = ChatTranscript(chat_store, user_id)
+            st.session_state.chat_conversation_id = None
+            save_state("chat_conversation_id")
+            st.rerun()
+
     # --- CHAT INTERFACE ---
-    # 1. Display Chat History
-    for msg in st.session_state.chat_history:
+    # 1. Display Chat History (older pages only when asked for)
+    if chat.has_older and st.button("⬆️ Load older messages"):
+        chat.load_older()
+        st.rerun()
+    if chat.older and st.button("⬇️ Hide older messages"):
+        chat.hide_older()
+        st.rerun()
+    for msg in chat.older + chat.recent:
         st.chat_message(msg['role']).write(msg['content'])
         
     # 2. User Input
     if user_input := st.chat_input("Ask about your PDF or general topics..."):
         # Add User Message to History
-        st.session_state.chat_history.append({"role": "user", "content": user_input})
+        is_new = chat.conversation_id is None
+        chat.add("user", user_input)
+        if is_new:
+            convs.insert(0, {"id": chat.conversation_id, "title": chat.title})
+            st.session_state.chat_conversation_id = chat.conversation_id
+            save_state("chat_conversation_id")
         st.chat_message("user").write(user_input)
         
         # 3. Construct System Prompt with PDF Context (if available)
         system_prompt = "You are a helpful AI Study Buddy."
         
-        if "chat_pdf_content" in st.session_state:
-            # We truncate to ~15,000 characters to prevent crashing the AI with too much text
-            pdf_context = st.session_state.chat_pdf_content[:15000]
+        doc = None
+        if "chat_doc_hash" in st.session_state:
+            doc = doc_library.load(st.session_state.user_id, st.session_state.chat_doc_hash)
+        if doc:
+            # Send the chunks most relevant to the question, capped at ~15,000 characters
+            pdf_context = context_for(doc, user_input, max_chars=15000)
             system_prompt += (
                 f"\n\nUSER HAS UPLOADED A PDF. HERE IS THE CONTENT:\n"
                 f"{pdf_context}\n\n"
@@ -478,9 +949,10 @@ def render_chat():
         with st.spinner("Thinking..."):
             response = ask_ai(user_input, system_role=system_prompt)
             
-            # Add AI Message to History
-            st.session_state.chat_history.append({"role": "assistant", "content": response})
+            # Add AI Message to History (the exchange is saved as one batch)
+            chat.add("assistant", response)
             st.chat_message("assistant").write(response)
+@profiler.timed
 def render_roadmap():
     st.header("🗺️ Study Roadmap")
     
@@ -495,27 +967,30 @@ def render_roadmap():
         
     if st.button("Generate Roadmap"):
         if topic:
-            with st.spinner(f"Planning your {days}-day journey for {topic}..."):
-                # specific prompt to force the AI to respect the day count
-                prompt = (
-                    f"Create a detailed, step-by-step study roadmap for learning '{topic}' in exactly {days} days. "
-                    f"Divide the plan logically (e.g., Week 1, Week 2, or Day 1-5). "
-                    f"For each section, include: \n"
-                    f"1. Key Topics to cover \n"
-                    f"2. Practical Exercises or Projects \n"
-                    f"3. Resources to look for. \n"
-                    f"Make the tone motivating and structured."
-                )
-                
-                roadmap = ask_ai(prompt)
-                st.markdown(roadmap)
-                add_xp(30, "Roadmap Created")
+            # specific prompt to force the AI to respect the day count
+            prompt = (
+                f"Create a detailed, step-by-step study roadmap for learning '{topic}' in exactly {days} days. "
+                f"Divide the plan logically (e.g., Week 1, Week 2, or Day 1-5). "
+                f"For each section, include: \n"
+                f"1. Key Topics to cover \n"
+                f"2. Practical Exercises or Projects \n"
+                f"3. Resources to look for. \n"
+                f"Make the tone motivating and structured."
+            )
+            start_job("roadmap", ask_ai, prompt, lane=LANE_BULK, user_id=st.session_state.user_id)
         else:
             st.warning("Please enter a topic to start.")
 
+    job = poll_job("roadmap", "Planning your study journey...")
+    if job and job["status"] == DONE:
+        st.markdown(job["result"])
+        if job_manager.claim(job["id"]):
+            add_xp(30, "Roadmap Created")
+
 # ==========================================
 # ⏳ UPGRADED STUDY SESSION (Pomodoro Style)
 # ==========================================
+@profiler.timed
 def render_study_session():
     st.header("⏳ Smart Focus Timer")
 
@@ -558,11 +1033,13 @@ def render_study_session():
                     st.session_state.timer_state["cycles_completed"] = 0
                     st.session_state.timer_state["duration"] = focus_min * 60
                     st.session_state.timer_state["end_time"] = time.time() + (focus_min * 60)
+                    save_state("timer_state")
                     st.rerun()
     with col_reset:
         # Stop Button
         if st.button("⏹️ Reset"):
             st.session_state.timer_state["active"] = False
+            save_state("timer_state")
             st.rerun()
 
     # --- 4. TIMER LOGIC (Runs only if active) ---
@@ -619,6 +1096,7 @@ def render_study_session():
                     st.success("🎉 Session Complete! You crushed it!")
                     st.balloons()
                     st.session_state.timer_state["active"] = False
+                    save_state("timer_state")
                     time.sleep(4) # Wait for sound/balloons
                     st.rerun()
                 else:
@@ -627,6 +1105,7 @@ def render_study_session():
                     st.session_state.timer_state["mode"] = "Break"
                     st.session_state.timer_state["duration"] = break_min * 60
                     st.session_state.timer_state["end_time"] = time.time() + (break_min * 60)
+                    save_state("timer_state")
                     time.sleep(2)
                     st.rerun()
             
@@ -637,6 +1116,7 @@ def render_study_session():
                 st.session_state.timer_state["mode"] = "Focus"
                 st.session_state.timer_state["duration"] = focus_min * 60
                 st.session_state.timer_state["end_time"] = time.time() + (focus_min * 60)
+                save_state("timer_state")
                 time.sleep(2)
                 st.rerun()
         
@@ -644,18 +1124,15 @@ def render_study_session():
         time.sleep(1)
         st.rerun()
 
+@profiler.timed
 def render_gamification():
     st.header("🎮 Gamification Dashboard")
 
     # 1. Force Sync with Database to ensure data is visible
     if st.session_state.user_id:
         try:
-            # Fetch Stats
-            user_stats = supabase.table("user_stats").select("*").eq("user_id", st.session_state.user_id).execute()
-            if user_stats.data:
-                stats = user_stats.data[0]
-                st.session_state.xp = stats.get('xp', 0)
-                st.session_state.streak = stats.get('streak', 0)
+            # Fetch Stats (never raises: falls back to the session's numbers)
+            sync_user_stats(st.session_state.user_id)
             
             # Fetch Study Logs for the Chart
             logs = supabase.table("study_logs").select("*").eq("user_id", st.session_state.user_id).order("date", desc=True).limit(7).execute()
@@ -668,23 +1145,16 @@ def render_gamification():
     col1.metric("⭐ Total XP", st.session_state.xp)
     col2.metric("🔥 Current Streak", f"{st.session_state.streak} Days")
     
-    # Calculate Level
+    # Level from the shared threshold tables (progression.py)
     xp = st.session_state.xp
-    if xp < 100:
-        level = "Beginner"
-        next_level = 100
-    elif xp < 500:
-        level = "Intermediate"
-        next_level = 500
-    else:
-        level = "Grandmaster"
-        next_level = 1000 # Cap
-
+    _, level, progress_val, next_level = level_for(xp)
     col3.metric("🏆 Rank", level)
 
     # 3. Progress Bar to Next Level
-    st.write(f"**Progress to next level:** {xp}/{next_level} XP")
-    progress_val = min(1.0, xp / next_level) if next_level > 0 else 1.0
+    if next_level:
+        st.write(f"**Progress to next level:** {xp}/{next_level} XP")
+    else:
+        st.write(f"**Top level reached:** {xp} XP")
     st.progress(progress_val)
 
     st.divider()
@@ -700,18 +1170,14 @@ def render_gamification():
 
     # 5. Badges
     st.subheader("🏅 Your Badges")
-    badges = []
-    if xp > 0: badges.append("✅ First Step")
-    if xp >= 100: badges.append("🥉 Bronze Scholar")
-    if xp >= 500: badges.append("🥈 Silver Master")
-    if st.session_state.streak >= 3: badges.append("🔥 On Fire")
-    if st.session_state.streak >= 7: badges.append("🗓️ Week Warrior")
+    badges = badge_names(badge_mask(xp, st.session_state.streak))
 
     if badges:
         st.success(f"You have earned: {', '.join(badges)}")
     else:
         st.write("Keep studying to earn your first badge!")
 
+@profiler.timed
 def render_mistake_explainer():
     st.header("❌ Mistake Explainer")
     q = st.text_input("The Question")
@@ -719,25 +1185,49 @@ def render_mistake_explainer():
     if st.button("Analyze Mistake"):
         st.markdown(ask_ai(f"I answered '{wrong}' to the question '{q}'. Why is it wrong?"))
 
+@profiler.timed
 def render_career():
     st.header("💼 Career Connection")
     skill = st.text_input("Skill/Subject")
     if st.button("Show Jobs"):
         st.markdown(ask_ai(f"What careers require {skill}?"))
 
+@profiler.timed
 def render_learning_outcomes():
     st.header("🎯 Learning Outcomes")
     topic = st.text_input("Topic")
     if st.button("Generate"):
-        st.markdown(ask_ai(f"What are the learning outcomes for {topic}?"))
+        st.markdown(ask_ai_for_topic("outcomes", topic,
+            lambda: ask_ai_cached("outcomes", topic, OUTCOMES_PROMPT.format(topic=topic))))
 
+@profiler.timed
 def render_revision():
     st.header("🔁 Revision Mode")
     st.info("Generates key points for quick review.")
     topic = st.text_input("Topic to Revise")
     if st.button("Revise"):
-        st.markdown(ask_ai(f"Give me 5 crucial bullet points to remember about {topic}"))
+        st.markdown(ask_ai_for_topic("revision", topic,
+            lambda: ask_ai_cached("revision", topic, REVISION_PROMPT.format(topic=topic))))
+
+def generate_assessment(topic, target_level, user_id):
+    # Runs in a background job. Returns the parsed questions, or None if the AI
+    # didn't give us valid JSON.
+    prompt = (
+        f"Create 10 multiple choice questions about '{topic}'. "
+        f"Difficulty Level: {target_level}. "
+        "Output ONLY valid JSON format like this: "
+        "[{'q': 'Question text', 'options': ['A', 'B', 'C', 'D'], 'correct': 'Option Text'}, ...]"
+    )
+    try:
+        response = ask_ai(prompt, system_role=JSON_SYSTEM_ROLE, lane=LANE_BULK, user_id=user_id)
+        # Parse JSON
+        start = response.find('[')
+        end = response.rfind(']') + 1
+        return json.loads(response[start:end])
+    except Exception:
+        return None
 
+@profiler.timed
 def render_self_assessment():
     st.header("🧠 Self Assessment & Verification")
     st.info("Claim your confidence level by passing a verification test.")
@@ -757,28 +1247,22 @@ def render_self_assessment():
         
         if st.button("Start Verification Test"):
             if st.session_state.assessment_topic:
-                with st.spinner(f"Generating {target_level} level questions for {st.session_state.assessment_topic}..."):
-                    # Prompt for JSON format
-                    prompt = (
-                        f"Create 10 multiple choice questions about '{st.session_state.assessment_topic}'. "
-                        f"Difficulty Level: {target_level}. "
-                        "Output ONLY valid JSON format like this: "
-                        "[{'q': 'Question text', 'options': ['A', 'B', 'C', 'D'], 'correct': 'Option Text'}, ...]"
-                    )
-                    try:
-                        response = ask_ai(prompt, system_role="You are a strict JSON generator.")
-                        # Parse JSON
-                        start = response.find('[')
-                        end = response.rfind(']') + 1
-                        json_str = response[start:end]
-                        st.session_state.assessment_data = json.loads(json_str)
-                        st.session_state.assessment_stage = "test"
-                        st.rerun()
-                    except Exception as e:
-                        st.error("AI failed to generate test. Please try again.")
+                start_job("assessment", generate_assessment, st.session_state.assessment_topic, target_level,
+                          st.session_state.user_id)
             else:
                 st.warning("Please enter a topic.")
 
+        job = poll_job("assessment", "Generating your verification questions...")
+        if job and job["status"] == DONE:
+            job_manager.forget(job["id"])
+            del st.session_state.jobs["assessment"]
+            if job["result"]:
+                st.session_state.assessment_data = job["result"]
+                st.session_state.assessment_stage = "test"
+                st.rerun()
+            else:
+                st.error("AI failed to generate test. Please try again.")
+
     # --- STAGE 2: THE TEST ---
     elif st.session_state.assessment_stage == "test":
         st.subheader(f"📝 Verification Test: {st.session_state.assessment_topic}")
@@ -815,6 +1299,7 @@ def render_self_assessment():
         
         if percentage >= 80:
             st.balloons()
+@profiler.timed
 def render_daily_challenge():
     st.header("🎯 Daily Challenge")
     
@@ -842,6 +1327,7 @@ def render_daily_challenge():
         st.write("**Today's Goal:** Complete at least one Study Session, Quiz, or Flashcard review.")
         st.progress(0)
 
+@profiler.timed
 def render_weekly_progress():
     st.header("📈 Weekly Progress")
     
@@ -886,17 +1372,92 @@ def render_weekly_progress():
             
     except Exception as e:
         st.error(f"Error loading progress: {str(e)}")
+@profiler.timed
 def render_progress_tracker():
     st.header("📊 Progress Tracker")
     st.write(f"XP: {st.session_state.xp}")
     st.write(f"Streak: {st.session_state.streak}")
 
+def is_admin():
+    admins = st.secrets.get("ADMIN_EMAILS", [])
+    return bool(st.session_state.user) and st.session_state.user.email in admins
+
+@profiler.timed
+def render_profiler():
+    st.header("🛠️ Rerun Profiler")
+    st.caption("Times of the most recent reruns on this server process (all sessions).")
+    
+    reruns = profiler.reruns()
+    if not reruns:
+        st.info("No reruns recorded yet.")
+        return
+
+    # 1. Latest reruns
+    st.subheader("⏱️ Recent Reruns")
+    st.dataframe([
+        {"Page": r["label"], "Total (ms)": round(r["total_ms"], 1),
+         "Slowest Section": max(r["sections"], key=lambda x: x[1])[0] if r["sections"] else "-"}
+        for r in reversed(reruns[-20:])
+    ], use_container_width=True)
+
+    # 2. Breakdown per section
+    st.subheader("🧩 Breakdown by Section")
+    rows = [
+        {"Section": name, "Calls": calls, "Avg (ms)": round(total / calls, 1), "Max (ms)": round(worst, 1)}
+        for name, (calls, total, worst) in profiler.breakdown().items()
+    ]
+    st.dataframe(sorted(rows, key=lambda r: r["Avg (ms)"], reverse=True), use_container_width=True)
+
+    # 3. cProfile samples of the slowest reruns
+    slowest = [r for r in profiler.slowest() if "cprofile" in r]
+    if slowest:
+        st.subheader("🐢 Slowest Reruns (cProfile)")
+        for r in slowest:
+            with st.expander(f"{r['label']} — {r['total_ms']:.0f} ms"):
+                st.code(r["cprofile"])
+
+    # 4. Export
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button("📥 Download JSON", data=json.dumps({"reruns": reruns, "slowest": slowest}),
+                           file_name="rerun_profile.json", mime="application/json")
+    with col2:
+        if st.button("🗑️ Reset"):
+            profiler.reset()
+            st.rerun()
+
+def render_sync_queue():
+    st.header("📮 XP Sync Queue")
+    st.caption("Gamification writes waiting in this server's outbox (see outbox.py).")
+    stats = outbox.stats()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Pending", stats["pending"])
+    col2.metric("Dead letters", stats["dead"])
+    col3.metric("Oldest pending", f"{stats['oldest_age']:.0f}s")
+    if stats["last_error"]:
+        st.caption(f"Last error: {stats['last_error']}")
+
+    # Entries the stats store refused MAX_ATTEMPTS times. Requeue once the cause is fixed.
+    dead = outbox.dead_letters()
+    if not dead:
+        st.info("No dead letters.")
+        return
+    st.dataframe([
+        {"User": d["user_id"], "Kind": d["kind"], "Attempts": d["attempts"], "Last Error": d["last_error"]}
+        for d in dead
+    ], use_container_width=True)
+    if st.button("🔁 Requeue all"):
+        st.toast(f"Requeued {outbox.requeue_dead()} write(s)")
+        outbox_flusher.wake()
+        st.rerun()
+
 # ==========================================
 # 5. MAIN NAVIGATION LOGIC
 # ==========================================
 
 def main():
-    make_pwa_ready()
+    with profiler.section("make_pwa_ready"):
+        make_pwa_ready()
     if not st.session_state.user:
         # Simple Login Page
         st.title("📘 AI Study Buddy Login")
@@ -912,7 +1473,7 @@ def main():
         return
 
     # SIDEBAR
-    with st.sidebar:
+    with profiler.section("sidebar"), st.sidebar:
         st.title("Study Buddy")
         st.write(f"👤 {st.session_state.user.email}")
         
@@ -924,6 +1485,10 @@ def main():
             "💼 Career Connection", "❌ Mistake Explainer", 
              "📊 Progress Tracker", "🗺️ Study Roadmap"
         ]
+        if profiler.enabled and is_admin():
+            features.append("🛠️ Profiler")
+        if is_admin():
+            features.append("📮 XP Sync Queue")
         
         # Iterate to create buttons
         for f in features:
@@ -932,6 +1497,14 @@ def main():
                 st.rerun()
 
         st.divider()
+        model_stats = model_scheduler.stats()
+        st.caption(f"⚙️ AI queue depth: {job_manager.queue_depth()} tasks · "
+                   f"{model_stats['queued_interactive'] + model_stats['queued_bulk']} model calls")
+        cache_stats = semantic_cache.stats()
+        st.caption(f"♻️ Cache hits: {cache_stats['exact_hit_rate']:.0%} exact + {cache_stats['extra_hit_rate']:.0%} similar")
+        waiting = len(outbox.pending(st.session_state.user_id))
+        if waiting or st.session_state.stats_stale:
+            st.caption(f"⏳ {waiting} progress update(s) saved on this device, syncing when the database is reachable")
         if st.button("🚪 Logout"): logout_user()
 
     # GLOBAL BACK BUTTON (If not home)
@@ -942,27 +1515,31 @@ def main():
 
     # ROUTING
     f = st.session_state.feature
-    if f == "🏠 Home": render_home()
-    elif f == "🧠 Mind Map": render_mind_map()    
-    elif f == "🏆 Leaderboard": render_leaderboard()
-    elif f == "🎮 Gamification Dashboard": render_gamification()
-    elif f == "🎯 Daily Challenge": render_daily_challenge()
-    elif f == "📈 Weekly Progress": render_weekly_progress()
-    elif f == "📘 Explain Topic": render_explain_topic()
-    elif f == "🧠 Mind Maps": render_mindmap()    
-    elif f == "📝 Summarize Notes": render_summary()
-    elif f == "❓ Quiz Generator": render_quiz()
-    elif f == "⏳ Study Session": render_study_session()    
-    elif f == "🧠 Self Assessment": render_self_assessment()
-    elif f == "⏱️ Exam Mode": render_exam_mode()
-    elif f == "📚 Flashcards": render_flashcards()
-    elif f == "🔁 Revision Mode": render_revision()
-    elif f == "🎯 Learning Outcomes": render_learning_outcomes()
-    elif f == "💼 Career Connection": render_career()
-    elif f == "❌ Mistake Explainer": render_mistake_explainer()
-    elif f == "💬 Chat with AI": render_chat()
-    elif f == "📊 Progress Tracker": render_progress_tracker()
-    elif f == "🗺️ Study Roadmap": render_roadmap()
+    with profiler.section("routing"):
+        if f == "🏠 Home": render_home()
+        elif f == "🧠 Mind Map": render_mind_map()    
+        elif f == "🏆 Leaderboard": render_leaderboard()
+        elif f == "🎮 Gamification Dashboard": render_gamification()
+        elif f == "🎯 Daily Challenge": render_daily_challenge()
+        elif f == "📈 Weekly Progress": render_weekly_progress()
+        elif f == "📘 Explain Topic": render_explain_topic()
+        elif f == "🧠 Mind Maps": render_mindmap()    
+        elif f == "📝 Summarize Notes": render_summary()
+        elif f == "❓ Quiz Generator": render_quiz()
+        elif f == "⏳ Study Session": render_study_session()    
+        elif f == "🧠 Self Assessment": render_self_assessment()
+        elif f == "⏱️ Exam Mode": render_exam_mode()
+        elif f == "📚 Flashcards": render_flashcards()
+        elif f == "🔁 Revision Mode": render_revision()
+        elif f == "🎯 Learning Outcomes": render_learning_outcomes()
+        elif f == "💼 Career Connection": render_career()
+        elif f == "❌ Mistake Explainer": render_mistake_explainer()
+        elif f == "💬 Chat with AI": render_chat()
+        elif f == "📊 Progress Tracker": render_progress_tracker()
+        elif f == "🗺️ Study Roadmap": render_roadmap()
+        elif f == "🛠️ Profiler" and profiler.enabled and is_admin(): render_profiler()
+        elif f == "📮 XP Sync Queue" and is_admin(): render_sync_queue()
 
 if __name__ == "__main__":
-    main()
+    with profiler.rerun(st.session_state.get("feature", "")):
+        main()
@@ -0,0 +1,187 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+# ==========================================
+# PAGINATED, PERSISTED CHAT TRANSCRIPTS
+# ==========================================
+# Chat messages are stored per user and conversation (Supabase tables, or a local
+# SQLite stand-in). The page only keeps a ChatTranscript in session state: the most
+# recent page of messages plus any older pages the student asked for. New messages
+# are written in one batch per exchange, and the recent window is capped so a rerun
+# of the chat page costs the same no matter how long the conversation gets.
+#
+# Message numbers (seq) are assigned by the store when a batch is written, so two
+# tabs or replicas writing to the same conversation never overwrite or drop each
+# other's messages.
+
+DATA_DIR = os.environ.get("STUDY_BUDDY_DATA_DIR", ".study_buddy_data")
+
+PAGE_SIZE = 20
+
+
+# --- STORAGE BACKENDS ---
+class LocalChatStore:
+    def __init__(self, path=None):
+        self.path = path or os.path.join(DATA_DIR, "chat.db")
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        with self._connect() as db:
+            db.execute("pragma journal_mode=wal")
+            db.execute("""create table if not exists chat_conversations (
+                id text primary key, user_id text not null, title text not null, created_at real not null)""")
+            db.execute("""create table if not exists chat_messages (
+                conversation_id text not null, seq integer not null, user_id text not null,
+                role text not null, content text not null, created_at real not null,
+                primary key (conversation_id, seq))""")
+            db.execute("create index if not exists chat_conversations_user_idx on chat_conversations (user_id, created_at)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def list_conversations(self, user_id):
+        with self._connect() as db:
+            rows = db.execute(
+                "select id, title, created_at from chat_conversations where user_id = ? order by created_at desc",
+                (user_id,)).fetchall()
+        return [{"id": r[0], "title": r[1], "created_at": r[2]} for r in rows]
+
+    def create_conversation(self, user_id, conversation_id, title):
+        with self._lock, self._connect() as db:
+            db.execute("insert into chat_conversations values (?, ?, ?, ?)",
+                       (conversation_id, user_id, title, time.time()))
+
+    def append(self, user_id, conversation_id, messages):
+        # messages: list of {"role", "content"}, written in one transaction.
+        # Returns the seq given to each message.
+        now = time.time()
+        with self._lock, self._connect() as db:
+            db.execute("begin immediate")
+            first = db.execute("select coalesce(max(seq) + 1, 0) from chat_messages where conversation_id = ?",
+                               (conversation_id,)).fetchone()[0]
+            seqs = list(range(first, first + len(messages)))
+            db.executemany(
+                "insert into chat_messages values (?, ?, ?, ?, ?, ?)",
+                [(conversation_id, seq, user_id, m["role"], m["content"], now) for seq, m in zip(seqs, messages)])
+        return seqs
+
+    def page(self, user_id, conversation_id, before_seq=None, limit=PAGE_SIZE):
+        # Newest `limit` messages older than before_seq, returned oldest first
+        query = "select seq, role, content from chat_messages where user_id = ? and conversation_id = ?"
+        args = [user_id, conversation_id]
+        if before_seq is not None:
+            query += " and seq < ?"
+            args.append(before_seq)
+        query += " order by seq desc limit ?"
+        args.append(limit)
+        with self._connect() as db:
+            rows = db.execute(query, args).fetchall()
+        return [{"seq": r[0], "role": r[1], "content": r[2]} for r in reversed(rows)]
+
+
+class SupabaseChatStore:
+    # Tables chat_conversations / chat_messages (see supabase/migrations)
+    def __init__(self, client):
+        self.client = client
+
+    def list_conversations(self, user_id):
+        res = (self.client.table("chat_conversations").select("id, title, created_at")
+               .eq("user_id", user_id).order("created_at", desc=True).execute())
+        return res.data or []
+
+    def create_conversation(self, user_id, conversation_id, title):
+        self.client.table("chat_conversations").insert(
+            {"id": conversation_id, "user_id": user_id, "title": title}).execute()
+
+    def append(self, user_id, conversation_id, messages):
+        # The append_chat_messages RPC numbers the batch under a lock on the conversation
+        res = self.client.rpc("append_chat_messages", {
+            "p_conversation_id": conversation_id,
+            "p_messages": [{"role": m["role"], "content": m["content"]} for m in messages],
+        }).execute()
+        return res.data or []
+
+    def page(self, user_id, conversation_id, before_seq=None, limit=PAGE_SIZE):
+        query = (self.client.table("chat_messages").select("seq, role, content")
+                 .eq("user_id", user_id).eq("conversation_id", conversation_id))
+        if before_seq is not None:
+            query = query.lt("seq", before_seq)
+        res = query.order("seq", desc=True).limit(limit).execute()
+        return list(reversed(res.data or []))
+
+
+# --- SESSION-SIDE TRANSCRIPT ---
+class ChatTranscript:
+    def __init__(self, store, user_id, conversation_id=None, title=None, page_size=PAGE_SIZE, flush_every=2):
+        self.store = store
+        self.user_id = user_id
+        self.conversation_id = conversation_id
+        self.title = title
+        self.page_size = page_size
+        self.flush_every = flush_every
+        self.recent = []         # newest messages, capped at page_size
+        self.older = []          # older messages loaded on demand
+        self.pending = []        # not yet written to the store
+        self.has_older = False
+        self.next_seq = 0        # provisional seq for new messages until the store numbers them
+        if conversation_id:
+            self._load_latest()
+
+    def _load_latest(self):
+        # Ask for one extra row so we know whether an older page exists
+        rows = self.store.page(self.user_id, self.conversation_id, limit=self.page_size + 1)
+        self.has_older = len(rows) > self.page_size
+        self.recent = rows[-self.page_size:]
+        self.next_seq = rows[-1]["seq"] + 1 if rows else 0
+
+    def load_older(self):
+        first = (self.older or self.recent)
+        if not first or not self.has_older:
+            return
+        rows = self.store.page(self.user_id, self.conversation_id,
+                               before_seq=first[0]["seq"], limit=self.page_size + 1)
+        self.has_older = len(rows) > self.page_size
+        self.older = rows[-self.page_size:] + self.older
+
+    def hide_older(self):
+        self.older = []
+        self.has_older = bool(self.recent) and self.recent[0]["seq"] > 0
+
+    def add(self, role, content):
+        if self.conversation_id is None:
+            # First message starts the conversation; its text becomes the title
+            self.conversation_id = str(uuid.uuid4())
+            self.title = content[:60]
+            self.store.create_conversation(self.user_id, self.conversation_id, self.title)
+        message = {"seq": self.next_seq, "role": role, "content": content}
+        self.next_seq += 1
+        self.recent.append(message)
+        self.pending.append(message)
+        if len(self.recent) > self.page_size:
+            # Keep the window constant. Dropped messages are stored (or about to be,
+            # via pending) and come back as older pages when asked for.
+            dropped = self.recent[:-self.page_size]
+            self.recent = self.recent[-self.page_size:]
+            if self.older:
+                self.older.extend(dropped)
+            self.has_older = True
+        if len(self.pending) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        expected = self.pending[0]["seq"]
+        seqs = self.store.append(self.user_id, self.conversation_id, self.pending)
+        for message, seq in zip(self.pending, seqs):
+            message["seq"] = seq
+        self.pending = []
+        if seqs and seqs[0] != expected:
+            # Another tab or replica wrote to this conversation in the meantime:
+            # reload the latest page so its messages show up in order
+            self.older = []
+            self._load_latest()
+        elif seqs:
+            self.next_seq = seqs[-1] + 1
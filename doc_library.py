@@ -0,0 +1,244 @@
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+
+# ==========================================
+# PERSISTENT PER-USER DOCUMENT LIBRARY
+# ==========================================
+# Each uploaded PDF is parsed ONCE. Its extracted text, chunks and a small BM25
+# search index are stored under the SHA-256 of the file bytes, so uploading the
+# same course pack again (or reopening it next session) does no PDF parsing.
+# The library listing only carries metadata; full documents are loaded lazily.
+
+DATA_DIR = os.environ.get("STUDY_BUDDY_DATA_DIR", ".study_buddy_data")
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 150
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _terms(text):
+    return re.findall(r"[a-z0-9]{2,}", text.lower())
+
+
+def chunk_text(text, size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    # Fixed-size character windows, nudged to end on whitespace where possible
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(len(text), start + size)
+        if end < len(text):
+            space = text.rfind(" ", start + size // 2, end)
+            if space != -1:
+                end = space
+        chunks.append(text[start:end].strip())
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return [c for c in chunks if c]
+
+
+def build_index(chunks):
+    # Inverted index: term -> [[chunk_id, term_frequency], ...]
+    postings = {}
+    lengths = []
+    for chunk_id, chunk in enumerate(chunks):
+        counts = Counter(_terms(chunk))
+        lengths.append(sum(counts.values()))
+        for term, tf in counts.items():
+            postings.setdefault(term, []).append([chunk_id, tf])
+    return {"postings": postings, "lengths": lengths}
+
+
+def search(index, query, top_k=5, k1=1.5, b=0.75):
+    # BM25 ranking of chunk ids for the query
+    lengths = index["lengths"]
+    if not lengths:
+        return []
+    n = len(lengths)
+    avg_len = (sum(lengths) / n) or 1
+    scores = {}
+    for term in set(_terms(query)):
+        posting = index["postings"].get(term)
+        if not posting:
+            continue
+        idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+        for chunk_id, tf in posting:
+            norm = tf + k1 * (1 - b + b * lengths[chunk_id] / avg_len)
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (k1 + 1) / norm
+    return sorted(scores, key=scores.get, reverse=True)[:top_k]
+
+
+# --- STORAGE BACKENDS ---
+class LocalDocumentStore:
+    # One JSON file per document plus a small manifest per user
+    def __init__(self, root=None):
+        self.root = os.path.join(root or DATA_DIR, "library")
+        self._lock = threading.Lock()
+
+    def _user_dir(self, user_id):
+        safe = re.sub(r"[^A-Za-z0-9_-]", "_", str(user_id))
+        path = os.path.join(self.root, safe)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def _read_manifest(self, user_id):
+        path = os.path.join(self._user_dir(user_id), "manifest.json")
+        if not os.path.exists(path):
+            return {}
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write_manifest(self, user_id, manifest):
+        path = os.path.join(self._user_dir(user_id), "manifest.json")
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(tmp, path)
+
+    def list(self, user_id):
+        with self._lock:
+            return sorted(self._read_manifest(user_id).values(), key=lambda d: d["added_at"], reverse=True)
+
+    def load(self, user_id, doc_hash):
+        path = os.path.join(self._user_dir(user_id), f"{doc_hash}.json")
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def save(self, user_id, doc):
+        path = os.path.join(self._user_dir(user_id), f"{doc['doc_hash']}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(doc, f)
+        with self._lock:
+            manifest = self._read_manifest(user_id)
+            manifest[doc["doc_hash"]] = _metadata(doc)
+            self._write_manifest(user_id, manifest)
+
+    def delete(self, user_id, doc_hash):
+        path = os.path.join(self._user_dir(user_id), f"{doc_hash}.json")
+        if os.path.exists(path):
+            os.remove(path)
+        with self._lock:
+            manifest = self._read_manifest(user_id)
+            manifest.pop(doc_hash, None)
+            self._write_manifest(user_id, manifest)
+
+
+class SupabaseDocumentStore:
+    # Table "documents" (see supabase/migrations). Listing selects metadata only.
+    META_COLUMNS = "doc_hash, name, chars, num_chunks, added_at"
+
+    def __init__(self, client):
+        self.client = client
+
+    def list(self, user_id):
+        res = (self.client.table("documents").select(self.META_COLUMNS)
+               .eq("user_id", user_id).order("added_at", desc=True).execute())
+        return res.data or []
+
+    def load(self, user_id, doc_hash):
+        res = (self.client.table("documents").select("*")
+               .eq("user_id", user_id).eq("doc_hash", doc_hash).limit(1).execute())
+        if not res.data:
+            return None
+        row = res.data[0]
+        row["index"] = row.pop("search_index")
+        return row
+
+    def save(self, user_id, doc):
+        row = dict(doc)
+        row["search_index"] = row.pop("index")
+        row["user_id"] = user_id
+        self.client.table("documents").upsert(row, on_conflict="user_id,doc_hash").execute()
+
+    def delete(self, user_id, doc_hash):
+        self.client.table("documents").delete().eq("user_id", user_id).eq("doc_hash", doc_hash).execute()
+
+
+def _metadata(doc):
+    return {k: doc[k] for k in ("doc_hash", "name", "chars", "num_chunks", "added_at")}
+
+
+# --- LIBRARY ---
+class DocumentLibrary:
+    def __init__(self, store, max_loaded=16):
+        self.store = store
+        self.max_loaded = max_loaded
+        self._loaded = OrderedDict()   # (user_id, doc_hash) -> doc, small LRU
+        self._lock = threading.Lock()
+
+    def list(self, user_id):
+        return self.store.list(user_id)
+
+    def load(self, user_id, doc_hash):
+        key = (user_id, doc_hash)
+        with self._lock:
+            if key in self._loaded:
+                self._loaded.move_to_end(key)
+                return self._loaded[key]
+        doc = self.store.load(user_id, doc_hash)
+        if doc is not None:
+            self._remember(key, doc)
+        return doc
+
+    def add(self, user_id, name, data, extract_text):
+        # extract_text(data) -> str or None. Only called for content we haven't seen.
+        doc_hash = content_hash(data)
+        doc = self.load(user_id, doc_hash)
+        if doc is not None:
+            return doc
+        text = extract_text(data)
+        if not text:
+            return None
+        chunks = chunk_text(text)
+        doc = {
+            "doc_hash": doc_hash,
+            "name": name,
+            "chars": len(text),
+            "num_chunks": len(chunks),
+            "added_at": time.time(),
+            "text": text,
+            "chunks": chunks,
+            "index": build_index(chunks),
+        }
+        self.store.save(user_id, doc)
+        self._remember((user_id, doc_hash), doc)
+        return doc
+
+    def delete(self, user_id, doc_hash):
+        with self._lock:
+            self._loaded.pop((user_id, doc_hash), None)
+        self.store.delete(user_id, doc_hash)
+
+    def _remember(self, key, doc):
+        with self._lock:
+            self._loaded[key] = doc
+            self._loaded.move_to_end(key)
+            while len(self._loaded) > self.max_loaded:
+                self._loaded.popitem(last=False)
+
+
+def context_for(doc, query, max_chars=15000):
+    # Most relevant chunks for the question, kept in document order, up to max_chars.
+    # Falls back to the start of the document when nothing matches.
+    ranked = search(doc["index"], query, top_k=len(doc["chunks"]))
+    if not ranked:
+        return doc["text"][:max_chars]
+    picked, used = [], 0
+    for chunk_id in ranked:
+        chunk = doc["chunks"][chunk_id]
+        if used + len(chunk) > max_chars:
+            break
+        picked.append(chunk_id)
+        used += len(chunk)
+    return "\n...\n".join(doc["chunks"][i] for i in sorted(picked))
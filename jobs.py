@@ -0,0 +1,174 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# ==========================================
+# BACKGROUND JOB QUEUE
+# ==========================================
+# Long-running AI work (summaries, roadmaps, mind maps, assessments) is handed to
+# a small local worker pool so a widget click or rerun doesn't cancel or repeat it.
+# Jobs live in a process-wide store keyed by id, and the latest job of each kind is
+# also remembered per user so a reconnect can pick the result back up.
+#
+# Job functions run OUTSIDE the Streamlit script thread, so they must not touch
+# st.* or st.session_state. Do the UI work (and add_xp) when the result is collected.
+
+PENDING = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+THREAD_PREFIX = "study-job"
+
+
+class TooManyJobs(Exception):
+    """Raised when a user already has the maximum number of jobs in flight."""
+
+
+def in_job_thread():
+    # True when running inside one of the job workers (i.e. not on the page)
+    return threading.current_thread().name.startswith(THREAD_PREFIX)
+
+
+class JobManager:
+    def __init__(self, max_workers=4, max_jobs_per_user=2, max_speculative_per_user=1, keep_results_for=3600):
+        self.max_jobs_per_user = max_jobs_per_user
+        self.max_speculative_per_user = max_speculative_per_user
+        self.keep_results_for = keep_results_for
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=THREAD_PREFIX)
+        self._lock = threading.Lock()
+        self._jobs = {}      # job_id -> job dict
+        self._latest = {}    # (user_id, kind) -> job_id
+
+    # --- SUBMISSION ---
+    def submit(self, user_id, kind, fn, *args, **kwargs):
+        return self._submit(user_id, kind, fn, args, kwargs, speculative=False)
+
+    def submit_speculative(self, user_id, kind, fn, *args, on_drop=None, **kwargs):
+        # Prefetch work the user didn't ask for. It doesn't count towards the cap of
+        # jobs they started themselves, but has its own small cap: a new prefetch
+        # replaces the user's older ones that haven't started yet (on_drop() is called
+        # for each dropped job), and TooManyJobs is raised if the ones already
+        # running fill the cap.
+        return self._submit(user_id, kind, fn, args, kwargs, speculative=True, on_drop=on_drop)
+
+    def _submit(self, user_id, kind, fn, args, kwargs, speculative, on_drop=None):
+        dropped = []
+        with self._lock:
+            self._expire_old()
+            if not speculative and self._in_flight(user_id) >= self.max_jobs_per_user:
+                raise TooManyJobs(
+                    f"You already have {self.max_jobs_per_user} tasks running. Please wait for one to finish."
+                )
+            if speculative:
+                if self._in_flight(user_id, speculative=True, status=(RUNNING,)) >= self.max_speculative_per_user:
+                    raise TooManyJobs("A prefetch is already running for this user.")
+                # Queued prefetches are for a topic the user has moved on from
+                for job_id, j in list(self._jobs.items()):
+                    if j["user_id"] == user_id and j["speculative"] and j["status"] == PENDING:
+                        dropped.append(self._drop(job_id))
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                "id": job_id,
+                "user_id": user_id,
+                "kind": kind,
+                "status": PENDING,
+                "result": None,
+                "error": None,
+                "submitted_at": time.time(),
+                "started_at": None,
+                "finished_at": None,
+                "claimed": False,
+                "speculative": speculative,
+                "on_drop": on_drop,
+            }
+            self._latest[(user_id, kind)] = job_id
+        self._pool.submit(self._run, job_id, fn, args, kwargs)
+        for job in dropped:
+            if job["on_drop"]:
+                job["on_drop"]()
+        return job_id
+
+    def _run(self, job_id, fn, args, kwargs):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job["status"] = RUNNING
+            job["started_at"] = time.time()
+        try:
+            result = fn(*args, **kwargs)
+            status, error = DONE, None
+        except Exception as e:
+            result, status, error = None, FAILED, str(e)
+        with self._lock:
+            job["result"] = result
+            job["error"] = error
+            job["status"] = status
+            job["finished_at"] = time.time()
+
+    # --- LOOKUP ---
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def latest(self, user_id, kind):
+        with self._lock:
+            job_id = self._latest.get((user_id, kind))
+            job = self._jobs.get(job_id) if job_id else None
+            return dict(job) if job else None
+
+    def claim(self, job_id):
+        # Returns True only the first time a finished job is claimed, so rewards like
+        # XP are granted once even if the result is shown on many reruns/sessions.
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job or job["status"] != DONE or job.get("claimed"):
+                return False
+            job["claimed"] = True
+            return True
+
+    def forget(self, job_id):
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+            if job and self._latest.get((job["user_id"], job["kind"])) == job_id:
+                del self._latest[(job["user_id"], job["kind"])]
+
+    # --- METRICS ---
+    def queue_depth(self):
+        with self._lock:
+            return sum(1 for j in self._jobs.values() if j["status"] == PENDING)
+
+    def stats(self):
+        with self._lock:
+            counts = {PENDING: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+            for job in self._jobs.values():
+                counts[job["status"]] += 1
+            return counts
+
+    # --- INTERNALS (call with lock held) ---
+    def _in_flight(self, user_id, speculative=False, status=(PENDING, RUNNING)):
+        return sum(
+            1 for j in self._jobs.values()
+            if j["user_id"] == user_id and j["speculative"] == speculative and j["status"] in status
+        )
+
+    def _drop(self, job_id):
+        # A dropped job is never run: _run finds it gone
+        job = self._jobs.pop(job_id)
+        if self._latest.get((job["user_id"], job["kind"])) == job_id:
+            del self._latest[(job["user_id"], job["kind"])]
+        return job
+
+    def _expire_old(self):
+        cutoff = time.time() - self.keep_results_for
+        expired = [
+            job_id for job_id, j in self._jobs.items()
+            if j["finished_at"] is not None and j["finished_at"] < cutoff
+        ]
+        for job_id in expired:
+            job = self._jobs.pop(job_id)
+            if self._latest.get((job["user_id"], job["kind"])) == job_id:
+                del self._latest[(job["user_id"], job["kind"])]
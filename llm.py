@@ -0,0 +1,22 @@
+# ==========================================
+# MODEL BACKEND
+# ==========================================
+# A backend is a callable taking {"prompt", "system_role", "max_tokens"} and
+# returning the reply text. The app's Scheduler and the warm-up CLI both use it.
+
+MODEL = "llama-3.1-8b-instant"
+
+
+def make_groq_backend(client, model=MODEL, temperature=0.7):
+    def groq_backend(request):
+        completion = client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": request["system_role"]},
+                {"role": "user", "content": request["prompt"]}
+            ],
+            temperature=temperature,
+            max_tokens=request["max_tokens"]
+        )
+        return completion.choices[0].message.content
+    return groq_backend
@@ -0,0 +1,148 @@
+import json
+
+# ==========================================
+# INCREMENTAL MIND MAPS
+# ==========================================
+# The model returns a small JSON tree ({"l": label, "c": [children]}) and the DOT
+# source is built locally. Expanding a node asks the model only for that node's
+# children, so a deep map costs one small call per expansion.
+#
+# The tree is stored as flat parallel lists (labels / parents / expanded) which is
+# compact in session state. DOT is assembled from one cached fragment per node;
+# an expansion only rebuilds the fragments of the node that changed and its new
+# children. (Graphviz itself still lays out the whole graph when it is drawn.)
+
+MAX_CHILDREN = 6
+MAX_DEPTH = 8      # deeper levels of a generated tree are dropped
+
+TREE_PROMPT = (
+    "Create a mind map for '{topic}'. Output ONLY compact JSON in this exact shape: "
+    '{{"l": "{topic}", "c": [{{"l": "Subtopic", "c": [{{"l": "Detail", "c": []}}]}}]}}. '
+    "Use 4-6 main branches with 2-4 short details each. Labels must be at most 5 words."
+)
+
+EXPAND_PROMPT = (
+    "We are building a mind map about '{root}'. Branch: {path}. "
+    "List 3-{max_children} short sub-points (max 5 words each) for '{label}'. "
+    'Output ONLY a JSON array of strings, like ["Point one", "Point two"].'
+)
+
+
+def parse_tree(text):
+    # Pull the JSON object out of the model's reply and normalize the whole tree
+    start, end = text.find("{"), text.rfind("}") + 1
+    return normalize_tree(json.loads(text[start:end]))
+
+
+def normalize_tree(tree):
+    # Every node becomes {"l": str, "c": [nodes]}: bare strings are leaves, a
+    # missing or non-list "c" means no children, anything else is dropped.
+    # Raises ValueError if there is no usable root.
+    root = _node(tree)
+    if root is None:
+        raise ValueError("Mind map JSON has no root label")
+    return root
+
+
+def _node(item, depth=0):
+    if isinstance(item, str):
+        label, kids = item, []
+    elif isinstance(item, dict):
+        label, kids = item.get("l"), item.get("c")
+    else:
+        return None
+    label = str(label).strip() if isinstance(label, (str, int, float)) else ""
+    if not label:
+        return None
+    if not isinstance(kids, list) or depth >= MAX_DEPTH:
+        kids = []
+    children = [child for child in (_node(kid, depth + 1) for kid in kids) if child is not None]
+    return {"l": label, "c": children[:MAX_CHILDREN]}
+
+
+def parse_children(text):
+    start, end = text.find("["), text.rfind("]") + 1
+    items = json.loads(text[start:end])
+    return [str(item).strip() for item in items if str(item).strip()][:MAX_CHILDREN]
+
+
+def _quote(label):
+    return '"' + label.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+class MindMap:
+    def __init__(self):
+        self.labels = []
+        self.parents = []
+        self.expanded = []       # True once a node's children are known
+        self.children = []       # derived from parents, kept for quick lookups
+        self._fragments = []     # per-node DOT snippet, None = needs rebuild
+
+    @classmethod
+    def from_tree(cls, tree):
+        mm = cls()
+        stack = [(tree, -1)]
+        while stack:
+            node, parent = stack.pop()
+            node_id = mm._add(str(node.get("l", "")).strip() or "?", parent)
+            kids = node.get("c") or []
+            mm.expanded[node_id] = bool(kids)
+            for kid in reversed(kids[:MAX_CHILDREN]):
+                stack.append((kid, node_id))
+        return mm
+
+    def _add(self, label, parent):
+        node_id = len(self.labels)
+        self.labels.append(label)
+        self.parents.append(parent)
+        self.expanded.append(False)
+        self.children.append([])
+        self._fragments.append(None)
+        if parent >= 0:
+            self.children[parent].append(node_id)
+            self._fragments[parent] = None
+        return node_id
+
+    # --- QUERIES ---
+    @property
+    def root(self):
+        return self.labels[0] if self.labels else ""
+
+    def path(self, node_id):
+        labels = []
+        while node_id >= 0:
+            labels.append(self.labels[node_id])
+            node_id = self.parents[node_id]
+        return list(reversed(labels))
+
+    def expandable(self):
+        # Nodes whose children haven't been generated yet
+        return [i for i in range(len(self.labels)) if not self.expanded[i]]
+
+    # --- UPDATES ---
+    def expand(self, node_id, child_labels):
+        for label in child_labels[:MAX_CHILDREN]:
+            self._add(label, node_id)
+        self.expanded[node_id] = True
+        self._fragments[node_id] = None
+
+    # --- RENDERING ---
+    def _fragment(self, node_id):
+        if self._fragments[node_id] is None:
+            shape = "ellipse" if node_id == 0 else "box"
+            style = ', style="filled", fillcolor="#d6eaf8"' if node_id == 0 else ""
+            dashed = "" if self.expanded[node_id] else ', style="dashed"'
+            lines = [f"  n{node_id} [label={_quote(self.labels[node_id])}, shape={shape}{style or dashed}];"]
+            lines += [f"  n{node_id} -> n{child};" for child in self.children[node_id]]
+            self._fragments[node_id] = "\n".join(lines)
+        return self._fragments[node_id]
+
+    def to_dot(self):
+        body = "\n".join(self._fragment(i) for i in range(len(self.labels)))
+        return (
+            "digraph G {\n"
+            "  rankdir=LR;\n"
+            '  node [fontname="Helvetica", fontsize=11];\n'
+            f"{body}\n"
+            "}"
+        )
@@ -0,0 +1,232 @@
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+
+from state_store import next_streak
+
+log = logging.getLogger(__name__)
+
+# ==========================================
+# GAMIFICATION OUTBOX
+# ==========================================
+# Every gamification write (XP awards, quiz submissions) is first appended to a
+# local SQLite log and acknowledged to the page straight away: the only cost on
+# the interaction path is one local commit (fsync). A background flusher replays
+# the log to the stats store in batches. Each entry carries an idempotency key,
+# and the store applies a key at most once, so replaying after a timeout or a
+# crash never double-counts XP. While the upstream is down the flusher backs off
+# and the entries wait on disk, so nothing is lost.
+#
+# Entries are applied one by one upstream and reported back per key. An entry
+# that fails on its own (e.g. its user was deleted) gets its own backoff and is
+# moved to the dead letter (dead = 1, kept on disk) after MAX_ATTEMPTS, so it
+# can't hold back the writes queued behind it. Admins can requeue dead letters
+# from the app (requeue_dead).
+#
+# The outbox is a file on THIS server, so until an entry is replayed:
+#  - only this replica sees it (another replica shows the user's stats without it
+#    until the flusher catches up, usually within seconds). Run replicas with
+#    sticky sessions, which Streamlit's websocket needs anyway, so a user keeps
+#    reading their own pending writes.
+#  - it is only as durable as the disk. Put STUDY_BUDDY_DATA_DIR on a persistent
+#    volume; a container whose disk is thrown away loses its unsent entries.
+#
+# The flusher runs OUTSIDE the Streamlit script thread and must not touch st.*.
+
+DATA_DIR = os.environ.get("STUDY_BUDDY_DATA_DIR", ".study_buddy_data")
+
+AWARD_XP = "award_xp"
+SUBMIT_QUIZ = "submit_quiz"
+MAX_ATTEMPTS = 8
+
+
+def project_stats(stats, writes):
+    # Stats as they will be once the pending writes are applied upstream
+    stats = dict(stats or {"xp": 0, "streak": 0, "last_study_date": None})
+    for write in writes:
+        payload = write["payload"]
+        if write["kind"] == AWARD_XP:
+            amount, day = payload["amount"], payload["day"]
+        else:
+            amount, day = payload["p_xp"], payload["p_date"]
+        stats["xp"] = (stats.get("xp") or 0) + amount
+        stats["streak"] = next_streak(stats.get("streak") or 0, stats.get("last_study_date"), day)
+        stats["last_study_date"] = day
+    return stats
+
+
+class Outbox:
+    def __init__(self, path=None):
+        self.path = path or os.path.join(DATA_DIR, "outbox.db")
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self._connect() as db:
+            db.execute("pragma journal_mode=wal")
+            db.execute("""create table if not exists outbox (
+                key text primary key, user_id text not null, kind text not null, payload text not null,
+                created_at real not null, attempts integer not null default 0, last_error text,
+                next_attempt_at real not null default 0, dead integer not null default 0)""")
+            columns = {row[1] for row in db.execute("pragma table_info(outbox)")}
+            if "dead" not in columns:
+                # Outboxes created before per-entry retries
+                db.execute("alter table outbox add column next_attempt_at real not null default 0")
+                db.execute("alter table outbox add column dead integer not null default 0")
+            db.execute("create index if not exists outbox_user_idx on outbox (user_id, created_at)")
+            db.execute("create index if not exists outbox_due_idx on outbox (dead, attempts, created_at)")
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=10)
+        # WAL + synchronous=full: a commit is durable once append() returns
+        db.execute("pragma synchronous=full")
+        return db
+
+    # --- WRITE PATH (page) ---
+    def append(self, user_id, kind, payload):
+        key = uuid.uuid4().hex
+        with self._connect() as db:
+            db.execute("insert into outbox (key, user_id, kind, payload, created_at) values (?, ?, ?, ?, ?)",
+                       (key, user_id, kind, json.dumps(payload), time.time()))
+        return key
+
+    def pending(self, user_id):
+        # This user's writes still on their way upstream, oldest first
+        with self._connect() as db:
+            rows = db.execute("select key, kind, payload from outbox where user_id = ? and dead = 0 "
+                              "order by created_at", (user_id,)).fetchall()
+        return [{"key": k, "user_id": user_id, "kind": kind, "payload": json.loads(p)} for k, kind, p in rows]
+
+    # --- REPLAY PATH (flusher) ---
+    def batch(self, limit=50, now=None):
+        # Due entries, fewest attempts first: retried entries go behind fresh ones
+        with self._connect() as db:
+            rows = db.execute("select key, user_id, kind, payload from outbox where dead = 0 and next_attempt_at <= ? "
+                              "order by attempts, created_at limit ?", (now or time.time(), limit)).fetchall()
+        return [{"key": k, "user_id": u, "kind": kind, "payload": json.loads(p)} for k, u, kind, p in rows]
+
+    def remove(self, keys):
+        with self._connect() as db:
+            db.executemany("delete from outbox where key = ?", [(k,) for k in keys])
+
+    def record_failure(self, errors, base_backoff=1.0, max_backoff=300.0, max_attempts=MAX_ATTEMPTS):
+        # errors: key -> message for entries the upstream refused. Each gets its own
+        # exponential backoff (with jitter); after max_attempts it is dead-lettered.
+        now = time.time()
+        with self._connect() as db:
+            for key, error in errors.items():
+                row = db.execute("select attempts from outbox where key = ?", (key,)).fetchone()
+                if row is None:
+                    continue
+                attempts = row[0] + 1
+                delay = min(max_backoff, base_backoff * 2 ** (attempts - 1)) * random.uniform(0.5, 1.0)
+                dead = attempts >= max_attempts
+                db.execute("update outbox set attempts = ?, last_error = ?, next_attempt_at = ?, dead = ? where key = ?",
+                           (attempts, str(error)[:500], now + delay, int(dead), key))
+                if dead:
+                    log.warning("Outbox entry %s dead-lettered after %d attempts: %s", key, attempts, error)
+
+    def dead_letters(self, limit=100):
+        with self._connect() as db:
+            rows = db.execute("select key, user_id, kind, payload, attempts, last_error from outbox where dead = 1 "
+                              "order by created_at limit ?", (limit,)).fetchall()
+        return [{"key": k, "user_id": u, "kind": kind, "payload": json.loads(p), "attempts": a, "last_error": e}
+                for k, u, kind, p, a, e in rows]
+
+    def requeue_dead(self, keys=None):
+        # Gives dead letters (all, or just these keys) a fresh set of attempts
+        with self._connect() as db:
+            if keys is None:
+                cur = db.execute("update outbox set dead = 0, attempts = 0, next_attempt_at = 0 where dead = 1")
+            else:
+                cur = db.executemany("update outbox set dead = 0, attempts = 0, next_attempt_at = 0 "
+                                     "where dead = 1 and key = ?", [(k,) for k in keys])
+            return cur.rowcount
+
+    # --- METRICS ---
+    def stats(self):
+        with self._connect() as db:
+            count, oldest, error = db.execute(
+                "select count(*), min(created_at), max(last_error) from outbox where dead = 0").fetchone()
+            dead = db.execute("select count(*) from outbox where dead = 1").fetchone()[0]
+        return {"pending": count, "dead": dead, "oldest_age": time.time() - oldest if oldest else 0.0,
+                "last_error": error}
+
+
+class OutboxFlusher:
+    def __init__(self, outbox, replay, batch_size=50, interval=2.0, base_backoff=1.0, max_backoff=300.0,
+                 max_attempts=MAX_ATTEMPTS):
+        # replay(writes) applies a batch upstream entry by entry and returns
+        # {"done": [keys applied now or before], "errors": {key: message}}.
+        # Keys in neither are retried like errors.
+        self.outbox = outbox
+        self.replay = replay
+        self.batch_size = batch_size
+        self.interval = interval
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        self.failures = 0       # consecutive batches the upstream didn't answer
+        self.retry_at = 0.0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="study-outbox", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout)
+
+    def wake(self):
+        # Called after an append so the write goes out without waiting for the next tick
+        self._wake.set()
+
+    def flush_once(self):
+        # Replays one batch; returns how many entries were confirmed
+        writes = self.outbox.batch(self.batch_size)
+        if not writes:
+            return 0
+        try:
+            result = self.replay(writes) or {}
+        except Exception:
+            # Upstream unreachable: nothing is wrong with the entries themselves,
+            # so they keep their attempts and the whole flusher backs off instead
+            self._back_off()
+            return 0
+        self.failures = 0
+        done = set(result.get("done") or [])
+        errors = dict(result.get("errors") or {})
+        for w in writes:
+            if w["key"] not in done:
+                errors.setdefault(w["key"], "not applied upstream")
+        self.outbox.remove([w["key"] for w in writes if w["key"] in done])
+        if errors:
+            self.outbox.record_failure(errors, self.base_backoff, self.max_backoff, self.max_attempts)
+        return len(done)
+
+    def _back_off(self):
+        # Exponential backoff with jitter, capped, for the whole flusher: if the
+        # upstream is down there's no point trying the next batch either
+        self.failures += 1
+        delay = min(self.max_backoff, self.base_backoff * 2 ** (self.failures - 1))
+        self.retry_at = time.time() + delay * random.uniform(0.5, 1.0)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            wait = self.retry_at - time.time()
+            if wait > 0:
+                self._stop.wait(wait)
+                continue
+            try:
+                sent = self.flush_once()
+            except Exception:
+                sent = 0  # local DB trouble: try again on the next tick
+            if sent < self.batch_size:
+                self._wake.wait(self.interval)
+                self._wake.clear()
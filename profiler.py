@@ -0,0 +1,154 @@
+import contextlib
+import cProfile
+import functools
+import heapq
+import io
+import json
+import os
+import pstats
+import threading
+import time
+from collections import deque
+
+# ==========================================
+# RERUN PROFILER (opt-in)
+# ==========================================
+# Streamlit re-executes app.py on every interaction. With profiling on, each rerun
+# is timed as a whole and split into named sections (make_pwa_ready, sidebar,
+# routing, every render_* function). In "cprofile" mode each rerun also runs under
+# cProfile and the stats of the top-N slowest reruns are kept.
+#
+#   STUDY_BUDDY_PROFILE=timing | cprofile   (unset = off)
+#   STUDY_BUDDY_PROFILE_DUMP=path.jsonl     (optional, one JSON line per rerun)
+#
+# When off, make_profiler() returns a NullProfiler: timed() hands back the original
+# function and section()/rerun() return one shared no-op context manager.
+
+_NULL_CONTEXT = contextlib.nullcontext()
+
+
+class NullProfiler:
+    enabled = False
+
+    def rerun(self, label=""):
+        return _NULL_CONTEXT
+
+    def section(self, name):
+        return _NULL_CONTEXT
+
+    def timed(self, fn):
+        return fn
+
+
+class RerunProfiler:
+    enabled = True
+
+    def __init__(self, use_cprofile=False, top_n=5, keep=200, dump_path=None):
+        self.use_cprofile = use_cprofile
+        self.top_n = top_n
+        self.dump_path = dump_path
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._history = deque(maxlen=keep)
+        self._slowest = []   # min-heap of (total_ms, seq, record with cProfile stats)
+        self._seq = 0
+
+    # --- RECORDING ---
+    @contextlib.contextmanager
+    def rerun(self, label=""):
+        record = {"label": label, "started_at": time.time(), "sections": []}
+        self._local.record = record
+        prof = None
+        if self.use_cprofile:
+            prof = cProfile.Profile()
+            try:
+                prof.enable()
+            except ValueError:
+                prof = None   # another profiler is active on this thread/interpreter
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["total_ms"] = (time.perf_counter() - start) * 1000
+            if prof is not None:
+                prof.disable()
+            self._local.record = None
+            self._finish(record, prof)
+
+    @contextlib.contextmanager
+    def section(self, name):
+        record = getattr(self._local, "record", None)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if record is not None:
+                record["sections"].append((name, (time.perf_counter() - start) * 1000))
+
+    def timed(self, fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with self.section(fn.__name__):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    def _finish(self, record, prof):
+        with self._lock:
+            self._seq += 1
+            self._history.append(record)
+            if prof is not None:
+                entry = (record["total_ms"], self._seq, record)
+                if len(self._slowest) < self.top_n:
+                    record["cprofile"] = _format_stats(prof)
+                    heapq.heappush(self._slowest, entry)
+                elif record["total_ms"] > self._slowest[0][0]:
+                    record["cprofile"] = _format_stats(prof)
+                    heapq.heapreplace(self._slowest, entry)
+        if self.dump_path:
+            line = {k: v for k, v in record.items() if k != "cprofile"}
+            with open(self.dump_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(line) + "\n")
+
+    # --- REPORTING ---
+    def reruns(self):
+        with self._lock:
+            return list(self._history)
+
+    def slowest(self):
+        with self._lock:
+            return [record for _, _, record in sorted(self._slowest, reverse=True)]
+
+    def breakdown(self):
+        # Per-section totals across the kept history: name -> (calls, total ms, max ms)
+        totals = {}
+        for record in self.reruns():
+            for name, ms in record["sections"]:
+                calls, total, worst = totals.get(name, (0, 0.0, 0.0))
+                totals[name] = (calls + 1, total + ms, max(worst, ms))
+        return totals
+
+    def dump(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"reruns": self.reruns(), "slowest": self.slowest()}, f, indent=2)
+
+    def reset(self):
+        with self._lock:
+            self._history.clear()
+            self._slowest = []
+
+
+def _format_stats(prof, limit=25):
+    out = io.StringIO()
+    pstats.Stats(prof, stream=out).sort_stats("cumulative").print_stats(limit)
+    return out.getvalue()
+
+
+def make_profiler(mode=None):
+    mode = (os.environ.get("STUDY_BUDDY_PROFILE", "") if mode is None else mode).lower()
+    if mode not in ("timing", "cprofile"):
+        return NullProfiler()
+    return RerunProfiler(
+        use_cprofile=(mode == "cprofile"),
+        top_n=int(os.environ.get("STUDY_BUDDY_PROFILE_TOP_N", "5")),
+        dump_path=os.environ.get("STUDY_BUDDY_PROFILE_DUMP") or None,
+    )
@@ -0,0 +1,113 @@
+import argparse
+import os
+import sys
+from bisect import bisect_right
+
+# ==========================================
+# PROGRESSION ENGINE (levels, progress, badges)
+# ==========================================
+# The one place that knows the thresholds. Each table is sorted by threshold and
+# looked up with bisect, so evaluating a user is a couple of binary searches
+# instead of if-chains spread over the pages.
+#
+# The result is stored next to XP/streak in user_stats (level, level_progress,
+# badges, progression_version) whenever they change, so leaderboards and
+# dashboards can filter by level with an indexed query. badges is a
+# bitmask over BADGES. Leaderboards rank by XP and use the stored level only as
+# a filter. After deploying the user_stats migration, and after changing a table
+# (bump PROGRESSION_VERSION first), run
+#
+#   python progression.py recompute            # Supabase (SUPABASE_URL + SUPABASE_SERVICE_ROLE_KEY)
+#   python progression.py recompute --local    # the local SQLite stats store
+
+PROGRESSION_VERSION = 1
+
+# (minimum XP, name); level numbers start at 1
+LEVELS = (
+    (0, "Beginner"),
+    (100, "Intermediate"),
+    (500, "Master"),
+    (1000, "Grandmaster"),
+)
+
+# (threshold, badge): earned once XP / streak reaches the threshold
+XP_BADGES = (
+    (1, "✅ First Step"),
+    (100, "🥉 Bronze Scholar"),
+    (500, "🥈 Silver Master"),
+)
+STREAK_BADGES = (
+    (3, "🔥 On Fire"),
+    (7, "🗓️ Week Warrior"),
+)
+
+BADGES = tuple(name for _, name in XP_BADGES + STREAK_BADGES)
+
+_LEVEL_XP = [xp for xp, _ in LEVELS]
+_XP_BADGE_XP = [xp for xp, _ in XP_BADGES]
+_STREAK_BADGE_DAYS = [days for days, _ in STREAK_BADGES]
+
+
+def level_for(xp):
+    # (level number, name, progress through this level 0..1, XP for the next level or None)
+    i = max(0, bisect_right(_LEVEL_XP, xp) - 1)
+    if i + 1 == len(LEVELS):
+        return i + 1, LEVELS[i][1], 1.0, None
+    start, end = _LEVEL_XP[i], _LEVEL_XP[i + 1]
+    return i + 1, LEVELS[i][1], (xp - start) / (end - start), end
+
+
+def level_name(level):
+    return LEVELS[min(max(level, 1), len(LEVELS)) - 1][1]
+
+
+def badge_mask(xp, streak):
+    # Thresholds are sorted, so the earned badges of each table are a prefix
+    xp_count = bisect_right(_XP_BADGE_XP, xp)
+    streak_count = bisect_right(_STREAK_BADGE_DAYS, streak)
+    return ((1 << xp_count) - 1) | (((1 << streak_count) - 1) << len(XP_BADGES))
+
+
+def badge_names(mask):
+    return [name for i, name in enumerate(BADGES) if mask >> i & 1]
+
+
+def evaluate(xp, streak):
+    # The columns stored alongside xp/streak in user_stats
+    xp, streak = xp or 0, streak or 0
+    level, _, progress, _ = level_for(xp)
+    return {
+        "level": level,
+        "level_progress": round(progress, 4),
+        "badges": badge_mask(xp, streak),
+        "progression_version": PROGRESSION_VERSION,
+    }
+
+
+# --- BULK RECOMPUTE (after a threshold change) ---
+def main(argv=None):
+    from state_store import LocalStatsStore, SupabaseStatsStore, DATA_DIR
+    parser = argparse.ArgumentParser(description="Recompute stored levels and badges for every user.")
+    parser.add_argument("command", choices=["recompute"])
+    parser.add_argument("--local", action="store_true", help="use the local SQLite stats store")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="where the local stats store lives")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args(argv)
+
+    if args.local:
+        store = LocalStatsStore(os.path.join(args.data_dir, "state.db"))
+    else:
+        from dotenv import load_dotenv
+        from supabase import create_client
+        load_dotenv()
+        url, key = os.environ.get("SUPABASE_URL"), os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
+        if not url or not key:
+            sys.exit("SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY must be set (or use --local)")
+        store = SupabaseStatsStore(create_client(url, key))
+    updated = store.recompute_progression(batch_size=args.batch_size)
+    print(f"Recomputed progression v{PROGRESSION_VERSION} for {updated} user(s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
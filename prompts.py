@@ -0,0 +1,22 @@
+# ==========================================
+# PROMPT TEMPLATES
+# ==========================================
+# Shared by the Streamlit renderers (app.py) and the offline warm-up CLI
+# (warmup.py), so pre-generated answers match what the app would ask for.
+# Mind map and topic bundle prompts live next to their parsers in mindmap.py
+# and topic_bundle.py.
+
+DEFAULT_SYSTEM_ROLE = "You are a helpful AI tutor."
+JSON_SYSTEM_ROLE = "You are a strict JSON generator."
+
+EXPLAIN_PROMPT = "Explain {topic} at a {level} level."
+REVISION_PROMPT = "Give me 5 crucial bullet points to remember about {topic}"
+OUTCOMES_PROMPT = "What are the learning outcomes for {topic}?"
+FLASHCARDS_PROMPT = "Create 5 flashcards for {topic}. Format: Front | Back"
+QUIZ_PROMPT = (
+    "Create {num_q} multiple choice questions about {topic}. "
+    "Output ONLY valid JSON format like this: "
+    "[{{'question': '...', 'options': ['A', 'B', 'C', 'D'], 'correct': 'Option Text'}}, ...]"
+)
+
+EXPLAIN_LEVELS = ["5-Year Old", "High School", "University"]
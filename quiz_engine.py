@@ -0,0 +1,115 @@
+import datetime
+import time
+
+# ==========================================
+# QUIZ SESSION ENGINE
+# ==========================================
+# A quiz is held as a compact QuizSession: questions with the index of the right
+# option, and one byte per answer. Answers are recorded locally (no DB writes
+# while the student works), the whole quiz is scored in one pass, and submission
+# produces ONE gamification write (replayed through the outbox, see outbox.py),
+# which awards XP, writes a study_logs row and stores the attempt for analytics.
+
+UNANSWERED = 255
+XP_PER_CORRECT = 10
+
+
+class QuizSession:
+    def __init__(self, topic, questions):
+        # questions: list of (question text, tuple of options, index of correct option)
+        self.topic = topic
+        self.questions = questions
+        self.answers = bytearray([UNANSWERED] * len(questions))
+        self.started_at = time.time()
+        self.submitted = False
+        self.result = None
+
+    @classmethod
+    def from_ai(cls, topic, items):
+        # Accepts the AI's list of {"question"/"q", "options", "correct"} dicts.
+        # "correct" may be the option text or its letter ("A", "B", ...).
+        questions = []
+        for item in items if isinstance(items, list) else []:
+            if not isinstance(item, dict) or not isinstance(item.get("options"), list):
+                continue  # not a question object
+            text = item.get("question") or item.get("q")
+            options = tuple(str(o) for o in item["options"])
+            correct = str(item.get("correct", "")).strip()
+            if not text or len(options) < 2:
+                continue
+            if correct in options:
+                correct_index = options.index(correct)
+            elif len(correct) == 1 and correct.upper() in "ABCDEFGH"[:len(options)]:
+                correct_index = "ABCDEFGH".index(correct.upper())
+            else:
+                lowered = [o.strip().lower() for o in options]
+                if correct.lower() not in lowered:
+                    continue  # can't tell which answer is right, drop the question
+                correct_index = lowered.index(correct.lower())
+            questions.append((str(text), options, correct_index))
+        return cls(topic, questions)
+
+    def to_dict(self):
+        # JSON-friendly form for the external state store
+        return {
+            "topic": self.topic,
+            "questions": [[q, list(opts), correct] for q, opts, correct in self.questions],
+            "answers": list(self.answers),
+            "started_at": self.started_at,
+            "submitted": self.submitted,
+            "result": self.result,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        quiz = cls(data["topic"], [(q, tuple(opts), correct) for q, opts, correct in data["questions"]])
+        quiz.answers = bytearray(data["answers"])
+        quiz.started_at = data["started_at"]
+        quiz.submitted = data["submitted"]
+        quiz.result = data["result"]
+        return quiz
+
+    def __len__(self):
+        return len(self.questions)
+
+    # --- ANSWERS ---
+    def answer(self, i, option_index):
+        if self.submitted:
+            return
+        self.answers[i] = UNANSWERED if option_index is None else option_index
+
+    def chosen(self, i):
+        value = self.answers[i]
+        return None if value == UNANSWERED else value
+
+    def compact(self):
+        # e.g. "20-1": one character per question, "-" for unanswered
+        return "".join("-" if a == UNANSWERED else str(a) for a in self.answers)
+
+    # --- SCORING ---
+    def score(self):
+        # One pass over the answers: (number correct, per-question correctness)
+        marks = [a == q[2] for a, q in zip(self.answers, self.questions)]
+        return sum(marks), marks
+
+    def reopen(self):
+        # Back to answering, e.g. when the submission couldn't be saved
+        self.submitted = False
+        self.result = None
+
+    def submit(self, user_id, xp_per_correct=XP_PER_CORRECT, minutes=10):
+        # Scores the quiz and returns the payload of its outbox write
+        correct, marks = self.score()
+        self.submitted = True
+        self.result = {"correct": correct, "marks": marks, "xp": correct * xp_per_correct}
+        return {
+            "p_user_id": user_id,
+            "p_topic": self.topic,
+            "p_num_questions": len(self.questions),
+            "p_score": correct,
+            "p_answers": self.compact(),
+            "p_xp": self.result["xp"],
+            "p_minutes": minutes,
+            "p_duration_seconds": int(time.time() - self.started_at),
+            "p_date": str(datetime.date.today()),
+        }
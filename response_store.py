@@ -0,0 +1,56 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from semantic_cache import normalize_topic
+
+# ==========================================
+# PERSISTENT RESPONSE STORE
+# ==========================================
+# Generated answers that don't depend on the user (explanations, revision points,
+# learning outcomes, quizzes, mind map trees) keyed by feature, variant (e.g. the
+# explanation level) and normalized topic. The app reads and writes it, and the
+# warm-up CLI fills it ahead of exam weeks. Values are stored as JSON.
+
+DATA_DIR = os.environ.get("STUDY_BUDDY_DATA_DIR", ".study_buddy_data")
+
+
+class ResponseStore:
+    def __init__(self, path=None):
+        self.path = path or os.path.join(DATA_DIR, "responses.db")
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        with self._connect() as db:
+            db.execute("pragma journal_mode=wal")
+            db.execute("""create table if not exists responses (
+                feature text not null, variant text not null, topic_key text not null,
+                topic text not null, value text not null, source text not null, created_at real not null,
+                primary key (feature, variant, topic_key))""")
+            db.execute("create index if not exists responses_created_idx on responses (created_at)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def get(self, feature, topic, variant=""):
+        with self._connect() as db:
+            row = db.execute(
+                "select value from responses where feature = ? and variant = ? and topic_key = ?",
+                (feature, variant, normalize_topic(topic))).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, feature, topic, value, variant="", source="app"):
+        with self._lock, self._connect() as db:
+            db.execute(
+                "insert or replace into responses values (?, ?, ?, ?, ?, ?, ?)",
+                (feature, variant, normalize_topic(topic), topic, json.dumps(value), source, time.time()))
+
+    def recent(self, features, limit=2000):
+        # Newest entries for the given features: (feature, variant, topic, value)
+        marks = ",".join("?" * len(features))
+        with self._connect() as db:
+            rows = db.execute(
+                f"select feature, variant, topic, value from responses where feature in ({marks}) "
+                "order by created_at desc limit ?", (*features, limit)).fetchall()
+        return [(f, v, t, json.loads(value)) for f, v, t, value in rows]
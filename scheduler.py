@@ -0,0 +1,291 @@
+import itertools
+import threading
+import time
+
+# ==========================================
+# FAIR SCHEDULER FOR MODEL CALLS
+# ==========================================
+# Every model call passes through here before it reaches Groq.
+#  - Priority lanes: interactive work (chat, grading, explanations) is dispatched
+#    ahead of bulk generation (roadmaps, question banks, mind maps), but bulk still
+#    gets 1 slot in every INTERACTIVE_BURST+1 dispatches so it can't starve.
+#  - Weighted fair queueing inside a lane: each user has their own virtual finish
+#    time, so one student submitting 20 requests can't push everyone else back.
+#  - Per-user token buckets: when a user has used up their budget, interactive
+#    calls are "degraded" (shorter answers) and bulk calls wait in the queue until
+#    the bucket refills.
+#  - Admission control: when the queue is full, calls are rejected up front with a
+#    clear status instead of timing out against the API.
+#  - Speculative work (prefetches nobody asked for yet) never touches the user's
+#    own bucket: it is billed to a shared prefetch bucket, never reserves debt, and
+#    is skipped outright when either budget is short.
+#  - Queued tickets can be cancelled, so a page that stops waiting doesn't leave
+#    work behind.
+#
+# The backend is any callable request -> text, so the scheduler can be driven by a
+# fake model under synthetic load (run `python scheduler.py`).
+
+LANE_INTERACTIVE = "interactive"
+LANE_BULK = "bulk"
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+REJECTED = "rejected"
+EXPIRED = "expired"     # cancelled while still queued
+
+# Cost of a default interactive call (ask_ai's 1500 max tokens), in 1k-token units
+INTERACTIVE_COST = 1.5
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate              # tokens added per second
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self):
+        self._refill()
+        return self.tokens
+
+    def try_take(self, amount):
+        self._refill()
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return True
+        return False
+
+    def reserve(self, amount):
+        # Take the tokens now (possibly going negative) and return the wait in
+        # seconds until the debt is paid back.
+        self._refill()
+        self.tokens -= amount
+        return max(0.0, -self.tokens / self.rate)
+
+
+class Ticket:
+    def __init__(self, user_id, lane, request, cost):
+        self.user_id = user_id
+        self.lane = lane
+        self.request = request
+        self.cost = cost
+        self.status = QUEUED
+        self.degraded = False
+        self.eligible_at = 0.0
+        self.finish_tag = 0.0
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self._done = threading.Event()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+
+class Scheduler:
+    INTERACTIVE_BURST = 3
+
+    def __init__(self, backend, workers=4, max_queue=64, rate_per_min=6.0, burst=12.0,
+                 degraded_max_tokens=400, prefetch_rate_per_min=6.0, prefetch_burst=12.0, clock=time.monotonic):
+        self.backend = backend
+        self.max_queue = max_queue
+        self.rate = rate_per_min / 60.0
+        self.burst = burst
+        self.degraded_max_tokens = degraded_max_tokens
+        self.clock = clock
+        self._cond = threading.Condition()
+        self._queues = {LANE_INTERACTIVE: [], LANE_BULK: []}
+        self._vtime = {LANE_INTERACTIVE: 0.0, LANE_BULK: 0.0}
+        self._last_finish = {}        # (lane, user_id) -> finish tag
+        self._buckets = {}            # user_id -> TokenBucket
+        self._prefetch_bucket = TokenBucket(prefetch_rate_per_min / 60.0, prefetch_burst, clock)
+        self._interactive_streak = 0
+        self._seq = itertools.count()
+        self._stats = {"admitted": 0, "degraded": 0, "deferred": 0, "rejected": 0, "completed": 0,
+                       "prefetch_skipped": 0, "expired": 0}
+        self._running = 0
+        for i in range(workers):
+            threading.Thread(target=self._worker, name=f"model-worker-{i}", daemon=True).start()
+
+    # --- SUBMISSION ---
+    def submit(self, user_id, lane, request, speculative=False):
+        # request: {"prompt", "system_role", "max_tokens"}; cost is in units of 1k tokens
+        cost = max(0.25, request.get("max_tokens", 1000) / 1000)
+        ticket = Ticket(user_id, lane, request, cost)
+        with self._cond:
+            if self.queue_depth() >= self.max_queue:
+                return self._reject(ticket, "The AI queue is full.", "rejected")
+
+            bucket = self._bucket(user_id)
+            if speculative:
+                # Billed to the shared prefetch budget only, and only while the user
+                # could still afford an interactive call of their own
+                if bucket.available() < INTERACTIVE_COST or not self._prefetch_bucket.try_take(cost):
+                    return self._reject(ticket, "Prefetch skipped: no budget left.", "prefetch_skipped")
+            elif not bucket.try_take(cost):
+                if lane == LANE_INTERACTIVE:
+                    # Over budget: still answer, but shorter and cheaper
+                    ticket.degraded = True
+                    ticket.request = dict(request, max_tokens=min(request.get("max_tokens", 1000), self.degraded_max_tokens))
+                    ticket.cost = max(0.25, ticket.request["max_tokens"] / 1000)
+                    bucket.reserve(ticket.cost)
+                    self._stats["degraded"] += 1
+                else:
+                    # Bulk work waits until the user's bucket has refilled
+                    ticket.eligible_at = self.clock() + bucket.reserve(cost)
+                    self._stats["deferred"] += 1
+
+            key = (lane, user_id)
+            start = max(self._vtime[lane], self._last_finish.get(key, 0.0))
+            ticket.finish_tag = start + ticket.cost
+            self._last_finish[key] = ticket.finish_tag
+            self._queues[lane].append((ticket.finish_tag, next(self._seq), ticket))
+            self._stats["admitted"] += 1
+            self._cond.notify()
+        return ticket
+
+    def call(self, user_id, lane, request, timeout=None):
+        ticket = self.submit(user_id, lane, request)
+        ticket.wait(timeout)
+        return ticket
+
+    def cancel(self, ticket):
+        # Drops a still-queued ticket (status EXPIRED). Returns False once it has started.
+        with self._cond:
+            if ticket.status != QUEUED:
+                return False
+            self._queues[ticket.lane] = [e for e in self._queues[ticket.lane] if e[2] is not ticket]
+            ticket.status = EXPIRED
+            ticket.error = "Cancelled while queued."
+            ticket._done.set()
+            self._stats["expired"] += 1
+            return True
+
+    def can_prefetch(self, user_id, cost=INTERACTIVE_COST):
+        # Cheap check before starting speculative work for this user
+        with self._cond:
+            return (self._bucket(user_id).available() >= INTERACTIVE_COST
+                    and self._prefetch_bucket.available() >= cost)
+
+    # --- INTERNALS (call with the condition held) ---
+    def _bucket(self, user_id):
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = TokenBucket(self.rate, self.burst, self.clock)
+        return bucket
+
+    def _reject(self, ticket, error, stat):
+        ticket.status = REJECTED
+        ticket.error = error
+        ticket._done.set()
+        self._stats[stat] += 1
+        return ticket
+
+    # --- STATUS ---
+    def queue_depth(self):
+        return sum(len(q) for q in self._queues.values())
+
+    def position(self, ticket):
+        # How many queued requests will be dispatched before this one (approximate)
+        with self._cond:
+            if ticket.status != QUEUED:
+                return 0
+            ahead = sum(1 for tag, _, t in self._queues[ticket.lane] if tag < ticket.finish_tag)
+            if ticket.lane == LANE_BULK:
+                ahead += len(self._queues[LANE_INTERACTIVE])
+            return ahead
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats["queued_interactive"] = len(self._queues[LANE_INTERACTIVE])
+            stats["queued_bulk"] = len(self._queues[LANE_BULK])
+            stats["running"] = self._running
+            return stats
+
+    # --- DISPATCH ---
+    def _pick(self, lane, now):
+        eligible = [entry for entry in self._queues[lane] if entry[2].eligible_at <= now]
+        if not eligible:
+            return None
+        entry = min(eligible)
+        self._queues[lane].remove(entry)
+        self._vtime[lane] = max(self._vtime[lane], entry[0] - entry[2].cost)
+        return entry[2]
+
+    def _next_ticket(self):
+        # Called with the condition held. Blocks until something is dispatchable.
+        while True:
+            now = self.clock()
+            ticket = None
+            if self._interactive_streak >= self.INTERACTIVE_BURST:
+                ticket = self._pick(LANE_BULK, now)
+            if ticket is None:
+                ticket = self._pick(LANE_INTERACTIVE, now)
+                if ticket is not None:
+                    self._interactive_streak += 1
+            if ticket is None:
+                ticket = self._pick(LANE_BULK, now)
+            if ticket is not None:
+                if ticket.lane == LANE_BULK:
+                    self._interactive_streak = 0
+                return ticket
+
+            waits = [t.eligible_at - now for q in self._queues.values() for _, _, t in q]
+            self._cond.wait(timeout=min(waits) if waits else None)
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                ticket = self._next_ticket()
+                ticket.status = RUNNING
+                ticket.started_at = time.monotonic()
+                self._running += 1
+            try:
+                ticket.result = self.backend(ticket.request)
+                ticket.status = DONE
+            except Exception as e:
+                ticket.error = str(e)
+                ticket.status = FAILED
+            ticket.finished_at = time.monotonic()
+            with self._cond:
+                self._running -= 1
+                self._stats["completed"] += 1
+            ticket._done.set()
+
+
+# --- SYNTHETIC LOAD (python scheduler.py) ---
+def _fake_backend(request, latency=0.05):
+    time.sleep(latency)
+    return f"fake answer to: {request['prompt'][:30]}"
+
+
+if __name__ == "__main__":
+    sched = Scheduler(_fake_backend, workers=2, max_queue=200, rate_per_min=60, burst=5)
+    tickets = []
+    # One heavy user floods the bulk lane while five others chat
+    for i in range(40):
+        tickets.append(sched.submit("heavy", LANE_BULK, {"prompt": f"roadmap {i}", "max_tokens": 1500}))
+    for i in range(25):
+        tickets.append(sched.submit(f"student{i % 5}", LANE_INTERACTIVE, {"prompt": f"chat {i}", "max_tokens": 1000}))
+    for t in tickets:
+        t.wait()
+
+    for lane in (LANE_INTERACTIVE, LANE_BULK):
+        waits = sorted(t.started_at - t.submitted_at for t in tickets if t.lane == lane)
+        print(f"{lane:12s} n={len(waits):3d}  median wait {waits[len(waits) // 2]:.2f}s  max {waits[-1]:.2f}s")
+    print(sched.stats())
@@ -0,0 +1,266 @@
+import re
+import threading
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+# ==========================================
+# SEMANTIC (NEAR-DUPLICATE) PROMPT CACHE
+# ==========================================
+# Students type the same topic many ways ("photosynthesis", "Photosynthesis ",
+# "explain photosynthesis process"). An exact-key cache misses all of those, so
+# topics are normalized first and then matched against earlier ones with MinHash
+# signatures over character 3-grams. LSH banding keeps lookups cheap: only entries
+# that share at least one band are compared.
+#
+# A high 3-gram score alone is not enough: "organic"/"inorganic chemistry" or
+# "endothermic"/"exothermic reactions" look alike but are different topics. A near
+# hit also needs every word of each topic to match a word of the other, where two
+# words match if they are equal or differ only in their ending (newton/newtons,
+# law/laws). Numbers must be equal, and Roman numerals count as numbers, so
+# "World War I" matches "World War 1" but never "World War II".
+#
+#   python semantic_cache.py     # hit rates on a sample of student-style topics
+
+# Feature -> similarity threshold (estimated Jaccard). Features not listed here
+# bypass the cache entirely.
+SEMANTIC_CACHE_FEATURES = {
+    "explain": 0.8,
+    "revision": 0.8,
+    "outcomes": 0.8,
+}
+
+FILLER_WORDS = {
+    "a", "an", "the", "of", "in", "on", "to", "for", "and", "about", "is", "are",
+    "what", "how", "why", "does", "do", "me", "please", "explain", "describe",
+    "define", "definition", "tell", "give", "process", "concept", "topic", "basics",
+}
+
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+_PRIME = (1 << 31) - 1
+
+
+def normalize_topic(text):
+    # Lowercase, drop punctuation and filler words, collapse whitespace
+    words = re.findall(r"[a-z0-9]+", (text or "").lower())
+    kept = [w for w in words if w not in FILLER_WORDS]
+    return " ".join(kept or words)
+
+
+class SemanticCache:
+    def __init__(self, features=None, max_entries=2000, seed=7):
+        self.features = dict(SEMANTIC_CACHE_FEATURES if features is None else features)
+        self.max_entries = max_entries
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, _PRIME, size=NUM_PERM, dtype=np.uint64)
+        self._b = rng.integers(0, _PRIME, size=NUM_PERM, dtype=np.uint64)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # (namespace, normalized) -> entry dict (LRU order)
+        self._raw = {}                  # (namespace, raw topic) -> entry key
+        self._buckets = {}              # (namespace, band, band bytes) -> set of entry keys
+        self._stats = {"lookups": 0, "exact_hits": 0, "near_hits": 0, "misses": 0}
+
+    def enabled(self, feature):
+        return feature in self.features
+
+    # --- PUBLIC API ---
+    def get(self, feature, topic, variant=""):
+        # Returns (value, kind) where kind is "exact", "near" or None on a miss
+        if not self.enabled(feature):
+            return None, None
+        namespace = (feature, variant)
+        with self._lock:
+            self._stats["lookups"] += 1
+
+            # 1. Exact match on the raw topic (what a plain cache would give us)
+            key = self._raw.get((namespace, topic))
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._stats["exact_hits"] += 1
+                return self._entries[key]["value"], "exact"
+
+            # 2. Same topic after normalization
+            normalized = normalize_topic(topic)
+            key = (namespace, normalized)
+            if key in self._entries:
+                return self._near_hit(key, namespace, topic)
+
+            # 3. Similar topic via MinHash/LSH, confirmed word by word
+            words = _words(normalized)
+            signature = self._signature(words)
+            best_key, best_score = None, self.features[feature]
+            for cand in self._candidates(namespace, signature):
+                entry = self._entries[cand]
+                if not _same_words(entry["words"], words):
+                    continue
+                score = float(np.mean(entry["signature"] == signature))
+                if score >= best_score:
+                    best_key, best_score = cand, score
+            if best_key is not None:
+                return self._near_hit(best_key, namespace, topic)
+
+            self._stats["misses"] += 1
+            return None, None
+
+    def put(self, feature, topic, value, variant=""):
+        if not self.enabled(feature):
+            return
+        namespace = (feature, variant)
+        normalized = normalize_topic(topic)
+        key = (namespace, normalized)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            words = _words(normalized)
+            signature = self._signature(words)
+            self._entries[key] = {
+                "value": value,
+                "signature": signature,
+                "words": words,
+                "aliases": {topic},
+            }
+            self._raw[(namespace, topic)] = key
+            for band in range(BANDS):
+                self._buckets.setdefault(self._band_key(namespace, signature, band), set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["lookups"] or 1
+        stats["exact_hit_rate"] = stats["exact_hits"] / lookups
+        stats["extra_hit_rate"] = stats["near_hits"] / lookups
+        return stats
+
+    # --- INTERNALS (call with lock held) ---
+    def _near_hit(self, key, namespace, topic):
+        entry = self._entries[key]
+        self._entries.move_to_end(key)
+        # Remember this spelling so the next identical request is an exact hit
+        entry["aliases"].add(topic)
+        self._raw[(namespace, topic)] = key
+        self._stats["near_hits"] += 1
+        return entry["value"], "near"
+
+    def _signature(self, words):
+        padded = f" {' '.join(words)} "
+        shingles = {padded[i:i + 3] for i in range(max(1, len(padded) - 2))}
+        hashes = np.fromiter((zlib.crc32(s.encode()) for s in shingles), dtype=np.uint64)
+        # (a*x + b) mod p for every permutation/shingle pair, min over shingles
+        return ((self._a[:, None] * hashes[None, :] + self._b[:, None]) % _PRIME).min(axis=1)
+
+    def _band_key(self, namespace, signature, band):
+        return (namespace, band, signature[band * ROWS:(band + 1) * ROWS].tobytes())
+
+    def _candidates(self, namespace, signature):
+        found = set()
+        for band in range(BANDS):
+            found |= self._buckets.get(self._band_key(namespace, signature, band), set())
+        return found
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        namespace = key[0]
+        for band in range(BANDS):
+            bucket_key = self._band_key(namespace, entry["signature"], band)
+            bucket = self._buckets.get(bucket_key)
+            if bucket:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[bucket_key]
+        for alias in entry["aliases"]:
+            if self._raw.get((namespace, alias)) == key:
+                del self._raw[(namespace, alias)]
+
+
+_ROMAN = {"i": 1, "v": 5, "x": 10}
+
+
+def _roman(word):
+    # Small Roman numerals (i..xxxix) as an int, or None
+    if not re.fullmatch(r"x{0,3}(ix|iv|v?i{0,3})", word) or not word:
+        return None
+    total = 0
+    for i, ch in enumerate(word):
+        value = _ROMAN[ch]
+        total += -value if i + 1 < len(word) and _ROMAN[word[i + 1]] > value else value
+    return total
+
+
+def _words(normalized):
+    # Words used for matching: Roman numerals become digits and the "s" left over
+    # from a possessive ("newton's" -> "newton s") is dropped
+    words = []
+    for word in normalized.split():
+        if word == "s" and words:
+            continue
+        number = _roman(word)
+        words.append(str(number) if number is not None else word)
+    return tuple(words)
+
+
+def _word_match(a, b):
+    # Equal, or the same stem with a different ending (at most 2 letters).
+    # Words that differ at the start (in-/en-/ex- prefixes) and numbers never match.
+    if a == b:
+        return True
+    if a.isdigit() or b.isdigit() or min(len(a), len(b)) < 4:
+        return False
+    common = len(a) if b.startswith(a) else len(b) if a.startswith(b) else 0
+    if not common:
+        common = next(i for i, (x, y) in enumerate(zip(a, b)) if x != y)
+    return common >= max(len(a), len(b)) - 2
+
+
+def _same_words(a, b):
+    return (all(any(_word_match(x, y) for y in b) for x in a) and
+            all(any(_word_match(x, y) for y in a) for x in b))
+
+
+# --- HIT-RATE SAMPLE ---
+SAMPLE_QUERIES = [
+    "photosynthesis", "Photosynthesis ", "explain photosynthesis process", "what is photosynthesis",
+    "photosynthesis", "Photosynthesis in plants", "mitosis", "meiosis", "Mitosis", "explain mitosis",
+    "World War 1", "world war 2", "World War I", "newtons laws of motion", "Newton's laws of motion",
+    "newton laws of motion", "explain newtons laws", "the french revolution", "French Revolution",
+    "french revolution causes", "mitosis",
+]
+
+# Pairs that look alike but must never share an answer
+DIFFERENT_TOPICS = [
+    ("organic chemistry", "inorganic chemistry"),
+    ("endothermic reactions", "exothermic reactions"),
+    ("World War I", "World War II"),
+    ("World War 1", "World War II"),
+    ("mitosis", "meiosis"),
+    ("prokaryotic cells", "eukaryotic cells"),
+    ("homogeneous mixtures", "heterogeneous mixtures"),
+    ("Henry VII", "Henry VIII"),
+]
+
+
+if __name__ == "__main__":
+    cache = SemanticCache()
+    for query in SAMPLE_QUERIES:
+        value, kind = cache.get("explain", query)
+        print(f"{query!r:34s} {kind or 'miss'}" + (f"  <- {value!r}" if kind == "near" else ""))
+        if value is None:
+            cache.put("explain", query, query)
+    stats = cache.stats()
+    print(f"\n{stats['lookups']} lookups: {stats['exact_hit_rate']:.1%} exact, "
+          f"{stats['extra_hit_rate']:.1%} extra from similar topics, {stats['misses']} misses")
+
+    wrong = 0
+    for first, second in DIFFERENT_TOPICS:
+        cache = SemanticCache()
+        cache.put("explain", first, first)
+        value, kind = cache.get("explain", second)
+        if value is not None:
+            wrong += 1
+            print(f"FALSE MATCH: {second!r} -> {first!r}")
+    print(f"{len(DIFFERENT_TOPICS)} look-alike pairs, {wrong} false matches")
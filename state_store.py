@@ -0,0 +1,281 @@
+import datetime
+import json
+import logging
+import os
+import sqlite3
+import time
+
+from progression import PROGRESSION_VERSION, evaluate
+
+# ==========================================
+# EXTERNALIZED STATE (for N stateless replicas)
+# ==========================================
+# Two small interfaces, each with a Supabase implementation for production and a
+# local SQLite stand-in for tests and single-machine development:
+#
+#  - State stores keep the per-user session state that matters (active quiz,
+#    focus timer, open conversation) as JSON blobs, so whichever replica serves the
+#    next request can pick it up.
+#  - Stats stores own XP/streak. XP is only ever changed with atomic server-side
+#    increments (xp = xp + n), never by writing back a value computed in the
+#    browser session, so two tabs or two replicas can't overwrite each other.
+#    The only write path is replay() of the gamification outbox (see outbox.py).
+#    Level, progress and badges (see progression.py) are stored next to them and
+#    refreshed whenever XP/streak change.
+
+log = logging.getLogger(__name__)
+
+DATA_DIR = os.environ.get("STUDY_BUDDY_DATA_DIR", ".study_buddy_data")
+STATS_COLUMNS = ("xp", "streak", "last_study_date", "level", "level_progress", "badges")
+PROGRESSION_COLUMNS = ("level", "level_progress", "badges", "progression_version")
+
+
+def next_streak(streak, last_study_date, day):
+    # The streak rule (Postgres has the same in apply_gamification_write):
+    # same day keeps it, the day after extends it, anything else restarts at 1
+    if last_study_date == day:
+        return streak
+    yesterday = str(datetime.date.fromisoformat(day) - datetime.timedelta(days=1))
+    return streak + 1 if last_study_date == yesterday else 1
+
+
+class _LocalDB:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+
+    def connect(self):
+        db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        db.execute("pragma journal_mode=wal")
+        return db
+
+
+# --- SESSION STATE ---
+class LocalStateStore:
+    def __init__(self, path=None):
+        self._db = _LocalDB(path or os.path.join(DATA_DIR, "state.db"))
+        with self._db.connect() as db:
+            db.execute("""create table if not exists app_state (
+                user_id text not null, key text not null, value text not null, updated_at real not null,
+                primary key (user_id, key))""")
+
+    def get(self, user_id, key):
+        with self._db.connect() as db:
+            row = db.execute("select value from app_state where user_id = ? and key = ?", (user_id, key)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_many(self, user_id, keys):
+        marks = ",".join("?" * len(keys))
+        with self._db.connect() as db:
+            rows = db.execute(f"select key, value from app_state where user_id = ? and key in ({marks})",
+                              (user_id, *keys)).fetchall()
+        return {k: json.loads(v) for k, v in rows}
+
+    def set(self, user_id, key, value):
+        with self._db.connect() as db:
+            db.execute("insert or replace into app_state values (?, ?, ?, ?)",
+                       (user_id, key, json.dumps(value), time.time()))
+
+    def delete(self, user_id, key):
+        with self._db.connect() as db:
+            db.execute("delete from app_state where user_id = ? and key = ?", (user_id, key))
+
+
+class SupabaseStateStore:
+    # Table app_state (see supabase/migrations)
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, user_id, key):
+        return self.get_many(user_id, [key]).get(key)
+
+    def get_many(self, user_id, keys):
+        res = (self.client.table("app_state").select("key, value")
+               .eq("user_id", user_id).in_("key", list(keys)).execute())
+        return {row["key"]: row["value"] for row in res.data or []}
+
+    def set(self, user_id, key, value):
+        self.client.table("app_state").upsert(
+            {"user_id": user_id, "key": key, "value": value}, on_conflict="user_id,key").execute()
+
+    def delete(self, user_id, key):
+        self.client.table("app_state").delete().eq("user_id", user_id).eq("key", key).execute()
+
+
+# --- GAMIFICATION STATS ---
+class LocalStatsStore:
+    def __init__(self, path=None):
+        self._db = _LocalDB(path or os.path.join(DATA_DIR, "state.db"))
+        with self._db.connect() as db:
+            db.execute("""create table if not exists user_stats (
+                user_id text primary key, xp integer not null default 0,
+                streak integer not null default 0, last_study_date text,
+                level integer not null default 1, level_progress real not null default 0,
+                badges integer not null default 0, progression_version integer)""")
+            columns = {row[1] for row in db.execute("pragma table_info(user_stats)")}
+            if "level" not in columns:
+                # Stats databases created before progression was stored
+                db.execute("alter table user_stats add column level integer not null default 1")
+                db.execute("alter table user_stats add column level_progress real not null default 0")
+                db.execute("alter table user_stats add column badges integer not null default 0")
+                db.execute("alter table user_stats add column progression_version integer")
+            db.execute("drop index if exists user_stats_level_idx")
+            db.execute("create index if not exists user_stats_xp_idx on user_stats (xp desc)")
+            db.execute("create index if not exists user_stats_level_xp_idx on user_stats (level, xp desc)")
+            db.execute("""create table if not exists study_logs (
+                user_id text not null, minutes integer not null, activity_type text, date text)""")
+            db.execute("""create table if not exists quiz_attempts (
+                user_id text not null, topic text, num_questions integer, score integer, answers text,
+                xp_awarded integer, duration_seconds integer, created_at real)""")
+            db.execute("create table if not exists applied_writes (key text primary key, applied_at real)")
+
+    def get_stats(self, user_id):
+        with self._db.connect() as db:
+            return self._get(db, user_id)
+
+    def _get(self, db, user_id):
+        row = db.execute(f"select {', '.join(STATS_COLUMNS)} from user_stats where user_id = ?",
+                         (user_id,)).fetchone()
+        return dict(zip(STATS_COLUMNS, row)) if row else None
+
+    def _set_progression(self, db, user_id, xp, streak):
+        progression = evaluate(xp, streak)
+        db.execute(f"update user_stats set {', '.join(c + ' = ?' for c in PROGRESSION_COLUMNS)} where user_id = ?",
+                   (*(progression[c] for c in PROGRESSION_COLUMNS), user_id))
+
+    def _apply(self, db, user_id, amount, activity, minutes, day):
+        # Same rules as apply_gamification_write in Postgres: increment + streak + one
+        # log row. Runs inside the caller's BEGIN IMMEDIATE, so the read is safe.
+        db.execute("insert or ignore into user_stats (user_id) values (?)", (user_id,))
+        streak, last_study_date = db.execute("select streak, last_study_date from user_stats where user_id = ?",
+                                             (user_id,)).fetchone()
+        db.execute("update user_stats set xp = xp + ?, streak = ?, last_study_date = ? where user_id = ?",
+                   (amount, next_streak(streak, last_study_date, day), day, user_id))
+        db.execute("insert into study_logs values (?, ?, ?, ?)", (user_id, minutes, activity, day))
+        xp, streak = db.execute("select xp, streak from user_stats where user_id = ?", (user_id,)).fetchone()
+        self._set_progression(db, user_id, xp, streak)
+        return self._get(db, user_id)
+
+    def _apply_quiz(self, db, params):
+        stats = self._apply(db, params["p_user_id"], params["p_xp"], "Quiz: " + params["p_topic"],
+                            params["p_minutes"], params["p_date"])
+        db.execute("insert into quiz_attempts values (?, ?, ?, ?, ?, ?, ?, ?)", (
+            params["p_user_id"], params["p_topic"], params["p_num_questions"], params["p_score"],
+            params["p_answers"], params["p_xp"], params["p_duration_seconds"], time.time()))
+        return stats
+
+    def replay(self, writes):
+        # Outbox batch (see outbox.py). Each key is applied once, each entry in its
+        # own savepoint so a bad one doesn't hold back the rest of the batch.
+        done, errors = [], {}
+        with self._db.connect() as db:
+            db.execute("begin immediate")
+            try:
+                for w in writes:
+                    db.execute("savepoint entry")
+                    try:
+                        cur = db.execute("insert or ignore into applied_writes values (?, ?)", (w["key"], time.time()))
+                        if cur.rowcount:
+                            p = w["payload"]
+                            if w["kind"] == "award_xp":
+                                self._apply(db, w["user_id"], p["amount"], p["activity"], p["minutes"], p["day"])
+                            else:
+                                self._apply_quiz(db, p)
+                        db.execute("release entry")
+                        done.append(w["key"])
+                    except (sqlite3.Error, KeyError, TypeError) as e:
+                        db.execute("rollback to entry")
+                        db.execute("release entry")
+                        errors[w["key"]] = f"{type(e).__name__}: {e}"
+                db.execute("commit")
+            except Exception:
+                db.execute("rollback")
+                raise
+        return {"done": done, "errors": errors}
+
+    def leaderboard(self, limit=10, level=None):
+        # Ranked by XP (the source of truth); the stored level is only a filter.
+        # Served by the xp / (level, xp) indexes.
+        where, params = ("where level = ?", (level,)) if level else ("", ())
+        with self._db.connect() as db:
+            rows = db.execute(f"select user_id, {', '.join(STATS_COLUMNS)} from user_stats {where} "
+                              "order by xp desc limit ?", (*params, limit)).fetchall()
+        return [dict(zip(("user_id",) + STATS_COLUMNS, row)) for row in rows]
+
+    def recompute_progression(self, batch_size=500):
+        # Bulk path for threshold changes: every row not yet on PROGRESSION_VERSION
+        updated = 0
+        while True:
+            with self._db.connect() as db:
+                db.execute("begin immediate")
+                try:
+                    rows = db.execute("select user_id, xp, streak from user_stats where progression_version is null "
+                                      "or progression_version != ? limit ?", (PROGRESSION_VERSION, batch_size)).fetchall()
+                    for user_id, xp, streak in rows:
+                        self._set_progression(db, user_id, xp, streak)
+                    db.execute("commit")
+                except Exception:
+                    db.execute("rollback")
+                    raise
+            updated += len(rows)
+            if len(rows) < batch_size:
+                return updated
+
+
+class SupabaseStatsStore:
+    # Increments run inside Postgres functions (see supabase/migrations)
+    def __init__(self, client):
+        self.client = client
+
+    def get_stats(self, user_id):
+        res = (self.client.table("user_stats").select(", ".join(STATS_COLUMNS))
+               .eq("user_id", user_id).execute())
+        return res.data[0] if res.data else None
+
+    def replay(self, writes):
+        # Outbox batch (see outbox.py): {"done": [keys applied now or before], "errors": {key: message}}.
+        # Needs the service role client (replay_gamification_writes is not granted to users).
+        result = self.client.rpc("replay_gamification_writes", {"p_writes": writes}).execute().data or {}
+        applied = set(result.get("done") or [])
+        for user_id in {w["user_id"] for w in writes if w["key"] in applied}:
+            try:
+                self.update_progression(user_id)
+            except Exception:
+                # The writes are in; the next change or a bulk recompute catches up
+                log.warning("Could not update progression for user %s", user_id, exc_info=True)
+        return result
+
+    def update_progression(self, user_id, stats=None):
+        # Compare-and-set on xp/streak: a concurrent increment makes this a no-op
+        # rather than storing a level computed from stale numbers
+        if stats is None:
+            stats = self.get_stats(user_id)
+        if not stats:
+            return
+        (self.client.table("user_stats").update(evaluate(stats["xp"], stats["streak"]))
+         .eq("user_id", user_id).eq("xp", stats["xp"]).eq("streak", stats["streak"]).execute())
+
+    def leaderboard(self, limit=10, level=None):
+        # Ranked by XP (the source of truth); the stored level is only a filter.
+        # Served by the xp / (level, xp) indexes.
+        query = self.client.table("user_stats").select("user_id, " + ", ".join(STATS_COLUMNS))
+        if level:
+            query = query.eq("level", level)
+        return query.order("xp", desc=True).limit(limit).execute().data or []
+
+    def recompute_progression(self, batch_size=500):
+        # Bulk path for threshold changes: pages through users by id
+        updated, last_id = 0, None
+        while True:
+            query = (self.client.table("user_stats").select("user_id, xp, streak, progression_version")
+                     .order("user_id").limit(batch_size))
+            if last_id is not None:
+                query = query.gt("user_id", last_id)
+            rows = query.execute().data or []
+            for row in rows:
+                if row["progression_version"] != PROGRESSION_VERSION:
+                    self.update_progression(row["user_id"], row)
+                    updated += 1
+            if len(rows) < batch_size:
+                return updated
+            last_id = rows[-1]["user_id"]
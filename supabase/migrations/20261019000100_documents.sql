@@ -0,0 +1,20 @@
+-- Per-user document library: extracted text, chunks and search index stored once per file hash
+create table if not exists documents (
+    user_id uuid not null references auth.users (id) on delete cascade,
+    doc_hash text not null,
+    name text not null,
+    chars integer not null default 0,
+    num_chunks integer not null default 0,
+    added_at double precision not null,
+    text text not null,
+    chunks jsonb not null,
+    search_index jsonb not null,
+    primary key (user_id, doc_hash)
+);
+
+create index if not exists documents_user_added_idx on documents (user_id, added_at desc);
+
+alter table documents enable row level security;
+
+create policy "Users manage their own documents" on documents
+    for all using (auth.uid() = user_id) with check (auth.uid() = user_id);
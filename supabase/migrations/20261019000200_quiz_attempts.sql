@@ -0,0 +1,63 @@
+-- Quiz attempt history plus a single-call submission RPC:
+-- awards XP, updates the streak, writes one study_logs row and records the attempt.
+create table if not exists quiz_attempts (
+    id bigint generated always as identity primary key,
+    user_id uuid not null references auth.users (id) on delete cascade,
+    topic text not null,
+    num_questions integer not null,
+    score integer not null,
+    answers text not null,
+    xp_awarded integer not null default 0,
+    duration_seconds integer,
+    created_at timestamptz not null default now()
+);
+
+create index if not exists quiz_attempts_user_created_idx on quiz_attempts (user_id, created_at desc);
+
+alter table quiz_attempts enable row level security;
+
+create policy "Users read their own attempts" on quiz_attempts
+    for select using (auth.uid() = user_id);
+
+create or replace function submit_quiz_attempt(
+    p_user_id uuid,
+    p_topic text,
+    p_num_questions integer,
+    p_score integer,
+    p_answers text,
+    p_xp integer,
+    p_minutes integer,
+    p_duration_seconds integer,
+    p_date date
+) returns json
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+    stats record;
+begin
+    if auth.uid() is distinct from p_user_id then
+        raise exception 'not allowed';
+    end if;
+
+    update user_stats
+       set xp = xp + p_xp,
+           streak = case
+               when last_study_date::date = p_date then streak
+               when last_study_date::date = p_date - 1 then streak + 1
+               else 1
+           end,
+           last_study_date = p_date
+     where user_id = p_user_id
+     returning xp, streak, last_study_date into stats;
+
+    insert into study_logs (user_id, minutes, activity_type, date)
+    values (p_user_id, p_minutes, 'Quiz: ' || p_topic, p_date);
+
+    insert into quiz_attempts (user_id, topic, num_questions, score, answers, xp_awarded, duration_seconds)
+    values (p_user_id, p_topic, p_num_questions, p_score, p_answers, p_xp, p_duration_seconds);
+
+    return json_build_object('xp', stats.xp, 'streak', stats.streak, 'last_study_date', stats.last_study_date);
+end;
+$$;
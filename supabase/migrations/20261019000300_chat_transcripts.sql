@@ -0,0 +1,28 @@
+-- Persisted chat transcripts, paged by (conversation_id, seq)
+create table if not exists chat_conversations (
+    id uuid primary key,
+    user_id uuid not null references auth.users (id) on delete cascade,
+    title text not null,
+    created_at timestamptz not null default now()
+);
+
+create index if not exists chat_conversations_user_idx on chat_conversations (user_id, created_at desc);
+
+create table if not exists chat_messages (
+    conversation_id uuid not null references chat_conversations (id) on delete cascade,
+    seq integer not null,
+    user_id uuid not null references auth.users (id) on delete cascade,
+    role text not null,
+    content text not null,
+    created_at timestamptz not null default now(),
+    primary key (conversation_id, seq)
+);
+
+alter table chat_conversations enable row level security;
+alter table chat_messages enable row level security;
+
+create policy "Users manage their own conversations" on chat_conversations
+    for all using (auth.uid() = user_id) with check (auth.uid() = user_id);
+
+create policy "Users manage their own messages" on chat_messages
+    for all using (auth.uid() = user_id) with check (auth.uid() = user_id);
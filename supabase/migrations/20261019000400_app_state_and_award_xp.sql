@@ -0,0 +1,55 @@
+-- Per-user session state shared by every app replica
+create table if not exists app_state (
+    user_id uuid not null references auth.users (id) on delete cascade,
+    key text not null,
+    value jsonb not null,
+    updated_at timestamptz not null default now(),
+    primary key (user_id, key)
+);
+
+alter table app_state enable row level security;
+
+create policy "Users manage their own state" on app_state
+    for all using (auth.uid() = user_id) with check (auth.uid() = user_id);
+
+-- Atomic XP award: increments xp server-side, updates the streak and logs the
+-- activity in one transaction, so concurrent tabs/replicas never lose XP.
+create or replace function award_xp(
+    p_user_id uuid,
+    p_amount integer,
+    p_activity text,
+    p_minutes integer,
+    p_date date
+) returns json
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+    stats record;
+begin
+    if auth.uid() is distinct from p_user_id then
+        raise exception 'not allowed';
+    end if;
+
+    insert into user_stats (user_id, xp, streak)
+    select p_user_id, 0, 0
+    where not exists (select 1 from user_stats where user_id = p_user_id);
+
+    update user_stats
+       set xp = xp + p_amount,
+           streak = case
+               when last_study_date::date = p_date then streak
+               when last_study_date::date = p_date - 1 then streak + 1
+               else 1
+           end,
+           last_study_date = p_date
+     where user_id = p_user_id
+     returning xp, streak, last_study_date into stats;
+
+    insert into study_logs (user_id, minutes, activity_type, date)
+    values (p_user_id, p_minutes, p_activity, p_date);
+
+    return json_build_object('xp', stats.xp, 'streak', stats.streak, 'last_study_date', stats.last_study_date);
+end;
+$$;
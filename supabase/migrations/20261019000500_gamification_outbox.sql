@@ -0,0 +1,96 @@
+-- Idempotent replay of the app's gamification outbox (see outbox.py).
+-- Every write carries a key; a key is applied at most once, so the app can
+-- safely resend a batch after a timeout or a crash.
+create table if not exists applied_writes (
+    key text primary key,
+    user_id uuid not null references auth.users (id) on delete cascade,
+    kind text not null,
+    applied_at timestamptz not null default now()
+);
+
+alter table applied_writes enable row level security;
+
+-- Applies one write. Internal: only called from replay_gamification_writes.
+create or replace function apply_gamification_write(p_user_id uuid, p_kind text, p_payload jsonb)
+returns void
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+    v_amount integer;
+    v_date date;
+begin
+    if p_kind = 'award_xp' then
+        v_amount := (p_payload->>'amount')::integer;
+        v_date := (p_payload->>'day')::date;
+    elsif p_kind = 'submit_quiz' then
+        v_amount := (p_payload->>'p_xp')::integer;
+        v_date := (p_payload->>'p_date')::date;
+    else
+        raise exception 'unknown write kind %', p_kind;
+    end if;
+
+    insert into user_stats (user_id, xp, streak)
+    select p_user_id, 0, 0
+    where not exists (select 1 from user_stats where user_id = p_user_id);
+
+    update user_stats
+       set xp = xp + v_amount,
+           streak = case
+               when last_study_date::date = v_date then streak
+               when last_study_date::date = v_date - 1 then streak + 1
+               else 1
+           end,
+           last_study_date = v_date
+     where user_id = p_user_id;
+
+    if p_kind = 'award_xp' then
+        insert into study_logs (user_id, minutes, activity_type, date)
+        values (p_user_id, (p_payload->>'minutes')::integer, p_payload->>'activity', v_date);
+    else
+        insert into study_logs (user_id, minutes, activity_type, date)
+        values (p_user_id, (p_payload->>'p_minutes')::integer, 'Quiz: ' || (p_payload->>'p_topic'), v_date);
+
+        insert into quiz_attempts (user_id, topic, num_questions, score, answers, xp_awarded, duration_seconds)
+        values (p_user_id, p_payload->>'p_topic', (p_payload->>'p_num_questions')::integer,
+                (p_payload->>'p_score')::integer, p_payload->>'p_answers', v_amount,
+                (p_payload->>'p_duration_seconds')::integer);
+    end if;
+end;
+$$;
+
+revoke execute on function apply_gamification_write(uuid, text, jsonb) from public, anon, authenticated;
+
+-- Replays a batch of outbox entries: [{"key", "user_id", "kind", "payload"}, ...].
+-- Returns the keys that are now applied (including ones applied earlier).
+-- The service role may replay for any user; a signed-in user only for themselves.
+create or replace function replay_gamification_writes(p_writes jsonb)
+returns jsonb
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+    w jsonb;
+    v_user uuid;
+    done jsonb := '[]'::jsonb;
+begin
+    for w in select * from jsonb_array_elements(p_writes) loop
+        v_user := (w->>'user_id')::uuid;
+        if auth.role() is distinct from 'service_role' and auth.uid() is distinct from v_user then
+            continue;
+        end if;
+
+        insert into applied_writes (key, user_id, kind)
+        values (w->>'key', v_user, w->>'kind')
+        on conflict (key) do nothing;
+
+        if found then
+            perform apply_gamification_write(v_user, w->>'kind', w->'payload');
+        end if;
+        done := done || to_jsonb(w->>'key');
+    end loop;
+    return done;
+end;
+$$;
@@ -0,0 +1,26 @@
+-- Stored progression (see progression.py): level, progress through the level,
+-- badge bitmask and the version of the threshold tables they were computed with.
+-- The app refreshes them whenever XP/streak change; after a threshold change run
+-- `python progression.py recompute`.
+
+-- Older setups created a text "level" column that was never maintained
+do $$
+begin
+    if exists (
+        select 1 from information_schema.columns
+         where table_schema = 'public' and table_name = 'user_stats'
+           and column_name = 'level' and data_type = 'text'
+    ) then
+        alter table user_stats drop column level;
+    end if;
+end;
+$$;
+
+alter table user_stats
+    add column if not exists level integer not null default 1,
+    add column if not exists level_progress real not null default 0,
+    add column if not exists badges integer not null default 0,
+    add column if not exists progression_version integer;
+
+-- Leaderboards and dashboards filter/sort by level, then XP
+create index if not exists user_stats_level_xp_idx on user_stats (level desc, xp desc);
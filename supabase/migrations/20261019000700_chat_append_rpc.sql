@@ -0,0 +1,33 @@
+-- Numbers chat messages on the server. The conversation row is locked while a
+-- batch is numbered, so concurrent writers (two tabs, two replicas) get
+-- consecutive, non-overlapping seqs instead of silently dropping messages.
+create or replace function append_chat_messages(p_conversation_id uuid, p_messages jsonb)
+returns jsonb
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+    m jsonb;
+    v_seq integer;
+    seqs jsonb := '[]'::jsonb;
+begin
+    perform 1 from chat_conversations
+     where id = p_conversation_id and user_id = auth.uid()
+       for update;
+    if not found then
+        raise exception 'not allowed';
+    end if;
+
+    select coalesce(max(seq) + 1, 0) into v_seq
+      from chat_messages where conversation_id = p_conversation_id;
+
+    for m in select * from jsonb_array_elements(p_messages) loop
+        insert into chat_messages (conversation_id, seq, user_id, role, content)
+        values (p_conversation_id, v_seq, auth.uid(), m->>'role', m->>'content');
+        seqs := seqs || to_jsonb(v_seq);
+        v_seq := v_seq + 1;
+    end loop;
+    return seqs;
+end;
+$$;
@@ -0,0 +1,37 @@
+-- Outbox replay, entry by entry. Each entry runs in its own subtransaction, so
+-- one bad entry (e.g. a deleted user) is reported back with its error instead of
+-- rolling back and blocking the whole batch. Returns
+--   {"done": [keys applied now or before], "errors": {key: message}}.
+-- The app replays for every user from a background thread with the service
+-- role key; the function is not callable by signed-in users.
+create or replace function replay_gamification_writes(p_writes jsonb)
+returns jsonb
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+    w jsonb;
+    done jsonb := '[]'::jsonb;
+    errors jsonb := '{}'::jsonb;
+begin
+    for w in select * from jsonb_array_elements(p_writes) loop
+        begin
+            insert into applied_writes (key, user_id, kind)
+            values (w->>'key', (w->>'user_id')::uuid, w->>'kind')
+            on conflict (key) do nothing;
+
+            if found then
+                perform apply_gamification_write((w->>'user_id')::uuid, w->>'kind', w->'payload');
+            end if;
+            done := done || to_jsonb(w->>'key');
+        exception when others then
+            errors := errors || jsonb_build_object(w->>'key', sqlerrm);
+        end;
+    end loop;
+    return jsonb_build_object('done', done, 'errors', errors);
+end;
+$$;
+
+revoke execute on function replay_gamification_writes(jsonb) from public, anon, authenticated;
+grant execute on function replay_gamification_writes(jsonb) to service_role;
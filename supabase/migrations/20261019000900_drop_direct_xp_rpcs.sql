@@ -0,0 +1,6 @@
+-- XP, streaks, study logs and quiz attempts are only written by replaying the
+-- app's outbox (replay_gamification_writes -> apply_gamification_write), which
+-- also holds the one SQL copy of the streak rule. The direct RPCs are unused.
+-- (submit_quiz_attempt also failed for users without a user_stats row.)
+drop function if exists award_xp(uuid, integer, text, integer, date);
+drop function if exists submit_quiz_attempt(uuid, text, integer, integer, text, integer, integer, integer, date);
@@ -0,0 +1,7 @@
+-- Leaderboards rank by xp (the source of truth) and use the stored level only
+-- as a filter, so a level that is briefly stale can't misorder users.
+-- Deploy step: after this migration (and after any threshold change), run
+-- `python progression.py recompute` to fill level/level_progress/badges.
+drop index if exists user_stats_level_xp_idx;
+create index if not exists user_stats_xp_idx on user_stats (xp desc);
+create index if not exists user_stats_level_xp_idx on user_stats (level, xp desc);
@@ -0,0 +1,69 @@
+-- user_stats had no unique constraint on user_id, so the "insert ... where not
+-- exists" in apply_gamification_write could race (two replays for a new user)
+-- and create two rows for one user. Drop the duplicates, keeping the row with
+-- the most XP, then enforce one row per user and let the insert rely on it.
+delete from user_stats s
+ using user_stats keep
+ where s.user_id = keep.user_id
+   and (coalesce(keep.xp, 0) > coalesce(s.xp, 0)
+        or (coalesce(keep.xp, 0) = coalesce(s.xp, 0) and keep.id < s.id));
+
+do $$
+begin
+    if not exists (select 1 from pg_constraint where conname = 'user_stats_user_id_key') then
+        alter table user_stats add constraint user_stats_user_id_key unique (user_id);
+    end if;
+end;
+$$;
+
+-- Applies one write. Internal: only called from replay_gamification_writes.
+create or replace function apply_gamification_write(p_user_id uuid, p_kind text, p_payload jsonb)
+returns void
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+    v_amount integer;
+    v_date date;
+begin
+    if p_kind = 'award_xp' then
+        v_amount := (p_payload->>'amount')::integer;
+        v_date := (p_payload->>'day')::date;
+    elsif p_kind = 'submit_quiz' then
+        v_amount := (p_payload->>'p_xp')::integer;
+        v_date := (p_payload->>'p_date')::date;
+    else
+        raise exception 'unknown write kind %', p_kind;
+    end if;
+
+    insert into user_stats (user_id, xp, streak)
+    values (p_user_id, 0, 0)
+    on conflict (user_id) do nothing;
+
+    update user_stats
+       set xp = xp + v_amount,
+           streak = case
+               when last_study_date::date = v_date then streak
+               when last_study_date::date = v_date - 1 then streak + 1
+               else 1
+           end,
+           last_study_date = v_date
+     where user_id = p_user_id;
+
+    if p_kind = 'award_xp' then
+        insert into study_logs (user_id, minutes, activity_type, date)
+        values (p_user_id, (p_payload->>'minutes')::integer, p_payload->>'activity', v_date);
+    else
+        insert into study_logs (user_id, minutes, activity_type, date)
+        values (p_user_id, (p_payload->>'p_minutes')::integer, 'Quiz: ' || (p_payload->>'p_topic'), v_date);
+
+        insert into quiz_attempts (user_id, topic, num_questions, score, answers, xp_awarded, duration_seconds)
+        values (p_user_id, p_payload->>'p_topic', (p_payload->>'p_num_questions')::integer,
+                (p_payload->>'p_score')::integer, p_payload->>'p_answers', v_amount,
+                (p_payload->>'p_duration_seconds')::integer);
+    end if;
+end;
+$$;
+
+revoke execute on function apply_gamification_write(uuid, text, jsonb) from public, anon, authenticated;
@@ -0,0 +1,136 @@
+import pytest
+
+from scheduler import (Scheduler, TokenBucket, LANE_INTERACTIVE, LANE_BULK, QUEUED, REJECTED, EXPIRED,
+                       INTERACTIVE_COST)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+def request(max_tokens=1000):
+    return {"prompt": "p", "system_role": "s", "max_tokens": max_tokens}
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def sched(clock):
+    # No worker threads: tests dispatch by hand, so nothing runs behind their back.
+    # 60/min = 1 token (1k tokens) per second, burst of 2.
+    return Scheduler(lambda req: "ok", workers=0, max_queue=4, rate_per_min=60.0, burst=2.0,
+                     prefetch_rate_per_min=60.0, prefetch_burst=3.0, clock=clock)
+
+
+def pick(sched, lane):
+    with sched._cond:
+        return sched._pick(lane, sched.clock())
+
+
+def test_bucket_refills_with_clock(clock):
+    bucket = TokenBucket(rate=1.0, capacity=2.0, clock=clock)
+    assert bucket.try_take(2.0)
+    assert not bucket.try_take(1.0)
+    clock.advance(1)
+    assert bucket.try_take(1.0)
+    clock.advance(100)
+    assert bucket.available() == 2.0
+
+
+def test_admitted_within_budget(sched):
+    ticket = sched.submit("alice", LANE_INTERACTIVE, request(1000))
+    assert ticket.status == QUEUED
+    assert not ticket.degraded
+    assert ticket.eligible_at == 0.0
+    assert sched.stats()["admitted"] == 1
+    assert pick(sched, LANE_INTERACTIVE) is ticket
+
+
+def test_rejected_when_queue_full(sched):
+    for i in range(4):
+        assert sched.submit(f"user{i}", LANE_INTERACTIVE, request(250)).status == QUEUED
+    ticket = sched.submit("late", LANE_INTERACTIVE, request(250))
+    assert ticket.status == REJECTED
+    assert ticket.done
+    assert sched.stats()["rejected"] == 1
+
+
+def test_interactive_over_budget_is_degraded(sched):
+    sched.submit("alice", LANE_INTERACTIVE, request(2000))
+    ticket = sched.submit("alice", LANE_INTERACTIVE, request(1500))
+    assert ticket.status == QUEUED
+    assert ticket.degraded
+    assert ticket.request["max_tokens"] == 400
+    assert sched.stats()["degraded"] == 1
+    # Degrading is per user: someone else still gets a full answer
+    assert not sched.submit("bob", LANE_INTERACTIVE, request(1500)).degraded
+
+
+def test_bulk_over_budget_is_deferred_until_refill(sched, clock):
+    sched.submit("alice", LANE_BULK, request(2000))
+    ticket = sched.submit("alice", LANE_BULK, request(3000))
+    assert ticket.eligible_at == clock.now + 3.0
+    assert sched.stats()["deferred"] == 1
+
+    assert pick(sched, LANE_BULK) is not ticket   # the first, in-budget call
+    assert pick(sched, LANE_BULK) is None
+    clock.advance(2.9)
+    assert pick(sched, LANE_BULK) is None
+    clock.advance(0.1)
+    assert pick(sched, LANE_BULK) is ticket
+
+
+def test_fair_order_across_users(sched):
+    a1 = sched.submit("alice", LANE_INTERACTIVE, request(1000))
+    a2 = sched.submit("alice", LANE_INTERACTIVE, request(1000))
+    b1 = sched.submit("bob", LANE_INTERACTIVE, request(1000))
+    assert [pick(sched, LANE_INTERACTIVE) for _ in range(3)] == [a1, b1, a2]
+
+
+def test_cancel_only_while_queued(sched):
+    ticket = sched.submit("alice", LANE_INTERACTIVE, request(1000))
+    assert sched.cancel(ticket)
+    assert ticket.status == EXPIRED
+    assert ticket.done
+    assert sched.queue_depth() == 0
+    assert not sched.cancel(ticket)
+    assert sched.stats()["expired"] == 1
+
+
+def test_speculative_uses_prefetch_budget_not_users(sched):
+    ticket = sched.submit("alice", LANE_BULK, request(3000), speculative=True)
+    assert ticket.status == QUEUED
+    assert ticket.eligible_at == 0.0
+    # Alice's own bucket is untouched: her next call is neither degraded nor deferred
+    assert not sched.submit("alice", LANE_INTERACTIVE, request(1500)).degraded
+    # ...but the shared prefetch budget is spent
+    skipped = sched.submit("bob", LANE_BULK, request(1000), speculative=True)
+    assert skipped.status == REJECTED
+    assert sched.stats()["prefetch_skipped"] == 1
+
+
+def test_speculative_skipped_when_user_is_short(sched, clock):
+    sched.submit("alice", LANE_INTERACTIVE, request(1000))
+    assert not sched.can_prefetch("alice")
+    ticket = sched.submit("alice", LANE_BULK, request(1000), speculative=True)
+    assert ticket.status == REJECTED
+    clock.advance(INTERACTIVE_COST)
+    assert sched.can_prefetch("alice")
+    assert sched.submit("alice", LANE_BULK, request(1000), speculative=True).status == QUEUED
+
+
+def test_worker_runs_ticket(clock):
+    sched = Scheduler(lambda req: req["prompt"].upper(), workers=1, clock=clock)
+    ticket = sched.call("alice", LANE_INTERACTIVE, request(), timeout=5)
+    assert ticket.result == "P"
+    assert sched.stats()["completed"] == 1
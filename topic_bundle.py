@@ -0,0 +1,154 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from quiz_engine import QuizSession
+from semantic_cache import normalize_topic
+
+# ==========================================
+# TOPIC BUNDLES (SPECULATIVE PREFETCH)
+# ==========================================
+# A student studying one topic usually visits Explain Topic, Revision Mode,
+# Flashcards, Quiz Generator and Learning Outcomes in turn. When the first of
+# those is requested we answer it as usual and, in the background, generate the
+# rest in ONE structured call. The artifacts land in a per-user/topic cache that
+# the other renderers check before calling the model.
+#
+# Only the artifacts nobody has yet are asked for: ones the student already has
+# and ones the shared ResponseStore already answers are left out of the prompt.
+# A prefetch that fails or comes back incomplete backs off before the same
+# student/topic is tried again, so revisiting a page doesn't re-fire the call.
+
+ARTIFACTS = ("explanation", "revision", "flashcards", "quiz", "outcomes")
+
+# The bundled explanation is written for this level; other levels call the model
+BUNDLE_LEVEL = "High School"
+
+# Artifacts the app also keeps in the shared ResponseStore: artifact -> (feature, variant).
+# If the store already answers a topic (earlier students, warm-up), a per-user
+# bundle would mostly duplicate it.
+STORED_ARTIFACTS = {
+    "explanation": ("explain", BUNDLE_LEVEL),
+    "revision": ("revision", ""),
+    "flashcards": ("flashcards", ""),
+    "quiz": ("quiz", ""),
+    "outcomes": ("outcomes", ""),
+}
+
+BUNDLE_PROMPT = "A student is studying '{topic}'. Output ONLY one valid JSON object with these keys:\n{keys}"
+
+# artifact -> how it is described to the model
+ARTIFACT_SPECS = {
+    "explanation": '"explanation": a markdown explanation of {topic} at a High School level',
+    "revision": '"revision": 5 crucial markdown bullet points to remember about {topic}',
+    "flashcards": '"flashcards": 5 flashcards as markdown lines in the format "Front | Back"',
+    "quiz": ('"quiz": a list of 5 multiple choice questions like '
+             '{{"question": "...", "options": ["A", "B", "C", "D"], "correct": "Option Text"}}'),
+    "outcomes": '"outcomes": a markdown list of the learning outcomes for {topic}',
+}
+
+# Rough answer size per artifact, for max_tokens
+TOKENS_PER_ARTIFACT = 600
+
+# Backoff after a failed or incomplete prefetch: 1 min, 2 min, 4 min... up to an hour
+RETRY_BASE = 60
+RETRY_MAX = 3600
+# A prefetch still marked pending after this long is assumed lost
+PENDING_TIMEOUT = 300
+
+
+def bundle_prompt(topic, artifacts):
+    keys = ",\n".join(ARTIFACT_SPECS[a].format(topic=topic) for a in ARTIFACTS if a in artifacts)
+    return BUNDLE_PROMPT.format(topic=topic, keys=keys + ".")
+
+
+def parse_bundle(text, topic):
+    # Keep whichever artifacts came back in a usable shape
+    start, end = text.find("{"), text.rfind("}") + 1
+    data = json.loads(text[start:end])
+    bundle = {}
+    for key in ARTIFACTS:
+        value = data.get(key)
+        if key == "quiz":
+            # Only question objects the quiz engine can actually use
+            if len(QuizSession.from_ai(topic, value)):
+                bundle[key] = [item for item in value if isinstance(item, dict)]
+        elif isinstance(value, list):
+            bundle[key] = "\n".join(f"- {v}" if key != "flashcards" else str(v) for v in value)
+        elif isinstance(value, str) and value.strip():
+            bundle[key] = value
+    return bundle
+
+
+class BundleCache:
+    def __init__(self, max_topics=5000, ttl=24 * 3600):
+        self.max_topics = max_topics
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._bundles = OrderedDict()   # (user_id, normalized topic) -> {"at", "items"}
+        self._pending = {}    # key -> when the prefetch started
+        self._failures = {}   # key -> (consecutive failed attempts, retry not before)
+
+    def _key(self, user_id, topic):
+        return (user_id, normalize_topic(topic))
+
+    def get(self, user_id, topic, artifact):
+        key = self._key(user_id, topic)
+        with self._lock:
+            bundle = self._bundles.get(key)
+            if bundle is None:
+                return None
+            if time.time() - bundle["at"] > self.ttl:
+                del self._bundles[key]
+                return None
+            self._bundles.move_to_end(key)
+            return bundle["items"].get(artifact)
+
+    def put(self, user_id, topic, items):
+        key = self._key(user_id, topic)
+        with self._lock:
+            bundle = self._bundles.setdefault(key, {"at": time.time(), "items": {}})
+            # Don't overwrite what the student has already seen for this topic
+            for artifact, value in items.items():
+                bundle["items"].setdefault(artifact, value)
+            bundle["at"] = time.time()
+            self._bundles.move_to_end(key)
+            while len(self._bundles) > self.max_topics:
+                self._bundles.popitem(last=False)
+
+    def missing(self, user_id, topic):
+        # Artifacts this student's bundle doesn't have yet
+        key = self._key(user_id, topic)
+        with self._lock:
+            bundle = self._bundles.get(key)
+            items = bundle["items"] if bundle else {}
+            return [a for a in ARTIFACTS if a not in items]
+
+    def start_prefetch(self, user_id, topic):
+        # True if the caller should launch a prefetch: nothing in flight and not
+        # backing off after a failed attempt
+        key = self._key(user_id, topic)
+        now = time.time()
+        with self._lock:
+            started = self._pending.get(key)
+            if started is not None and now - started < PENDING_TIMEOUT:
+                return False
+            failures = self._failures.get(key)
+            if failures and now < failures[1]:
+                return False
+            self._pending[key] = now
+            return True
+
+    def finish_prefetch(self, user_id, topic, ok=True):
+        # ok=False for a failed or incomplete prefetch: the next attempt waits
+        key = self._key(user_id, topic)
+        with self._lock:
+            self._pending.pop(key, None)
+            if ok:
+                self._failures.pop(key, None)
+                return
+            attempts = self._failures.get(key, (0, 0))[0] + 1
+            self._failures[key] = (attempts, time.time() + min(RETRY_MAX, RETRY_BASE * 2 ** (attempts - 1)))
+            while len(self._failures) > self.max_topics:
+                self._failures.pop(next(iter(self._failures)))
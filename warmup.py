@@ -0,0 +1,241 @@
+import argparse
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from prompts import (DEFAULT_SYSTEM_ROLE, JSON_SYSTEM_ROLE, EXPLAIN_PROMPT, REVISION_PROMPT, OUTCOMES_PROMPT,
+                     FLASHCARDS_PROMPT, QUIZ_PROMPT, EXPLAIN_LEVELS)
+from mindmap import TREE_PROMPT, parse_tree
+from quiz_engine import QuizSession
+from response_store import ResponseStore, DATA_DIR
+from scheduler import TokenBucket
+from semantic_cache import normalize_topic
+
+# ==========================================
+# OFFLINE WARM-UP CLI
+# ==========================================
+# Pre-generates answers for a list of syllabus topics before exam weeks, using the
+# same prompt templates as the app, and writes them into the app's ResponseStore.
+#
+#   python warmup.py topics.txt                          # Groq (GROQ_API_KEY / .env)
+#   python warmup.py topics.txt --fake                   # local fake model, into a throwaway data dir
+#   python warmup.py topics.txt --features quiz,mindmap --concurrency 2 --rate 20
+#
+# topics.txt has one topic per line ("#" starts a comment); a .json file with a
+# list of topics (or {"topics": [...]}) also works. Finished tasks are appended to
+# a checkpoint file, so an interrupted run picks up where it stopped (--force
+# regenerates everything, ignoring both the checkpoint and the store).
+#
+# --fake answers are placeholders, so they never go into the app's real data dir
+# by accident: without an explicit --data-dir a fake run writes to a temp dir.
+
+FEATURES = ("explain", "revision", "outcomes", "flashcards", "quiz", "mindmap")
+DEFAULT_FEATURES = "explain,revision,quiz,mindmap"
+QUIZ_SIZE = 10
+
+
+# --- INPUT ---
+def read_topics(path):
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".json"):
+            data = json.load(f)
+            topics = data.get("topics", []) if isinstance(data, dict) else data
+        else:
+            topics = [line.split("#", 1)[0] for line in f]
+    seen, result = set(), []
+    for topic in (str(t).strip() for t in topics):
+        if topic and normalize_topic(topic) not in seen:
+            seen.add(normalize_topic(topic))
+            result.append(topic)
+    return result
+
+
+def build_tasks(topics, features, levels):
+    tasks = []
+    for topic in topics:
+        for feature in features:
+            variants = levels if feature == "explain" else [""]
+            for variant in variants:
+                tasks.append((feature, variant, topic))
+    return tasks
+
+
+def task_key(feature, variant, topic):
+    return f"{feature}|{variant}|{normalize_topic(topic)}"
+
+
+# --- GENERATION ---
+def generate(ask, feature, variant, topic):
+    # Returns the value to store, in the same shape the app stores it
+    if feature == "explain":
+        return ask(EXPLAIN_PROMPT.format(topic=topic, level=variant), DEFAULT_SYSTEM_ROLE)
+    if feature == "revision":
+        return ask(REVISION_PROMPT.format(topic=topic), DEFAULT_SYSTEM_ROLE)
+    if feature == "outcomes":
+        return ask(OUTCOMES_PROMPT.format(topic=topic), DEFAULT_SYSTEM_ROLE)
+    if feature == "flashcards":
+        return ask(FLASHCARDS_PROMPT.format(topic=topic), DEFAULT_SYSTEM_ROLE)
+    if feature == "quiz":
+        response = ask(QUIZ_PROMPT.format(num_q=QUIZ_SIZE, topic=topic), JSON_SYSTEM_ROLE)
+        items = json.loads(response[response.find("["):response.rfind("]") + 1])
+        if not len(QuizSession.from_ai(topic, items)):
+            raise ValueError("quiz has no usable questions")
+        return items
+    if feature == "mindmap":
+        return parse_tree(ask(TREE_PROMPT.format(topic=topic), JSON_SYSTEM_ROLE))
+    raise ValueError(f"unknown feature {feature}")
+
+
+def fake_model(request, latency=0.01):
+    # Deterministic stand-in for the real model, shaped like its answers
+    time.sleep(latency)
+    prompt = request["prompt"]
+    if "multiple choice" in prompt:
+        n = int(re.search(r"Create (\d+)", prompt).group(1))
+        return json.dumps([
+            {"question": f"Fake question {i + 1}?", "options": ["Alpha", "Beta", "Gamma", "Delta"], "correct": "Alpha"}
+            for i in range(n)
+        ])
+    if "mind map" in prompt:
+        topic = re.search(r"mind map for '(.+?)'", prompt).group(1)
+        return json.dumps({"l": topic, "c": [
+            {"l": f"Branch {i + 1}", "c": [{"l": f"Detail {i + 1}.{j + 1}", "c": []} for j in range(2)]}
+            for i in range(4)
+        ]})
+    return f"Fake answer for: {prompt}"
+
+
+# --- RUNNER ---
+class WarmupRunner:
+    def __init__(self, backend, store, checkpoint_path, concurrency=4, rate_per_min=30.0,
+                 retries=3, max_tokens=1500, force=False, log=print):
+        self.backend = backend
+        self.store = store
+        self.checkpoint_path = checkpoint_path
+        self.concurrency = concurrency
+        self.retries = retries
+        self.max_tokens = max_tokens
+        self.force = force
+        self.log = log
+        self._bucket = TokenBucket(rate_per_min / 60.0, capacity=max(1.0, concurrency))
+        self._bucket_lock = threading.Lock()
+        self._checkpoint_lock = threading.Lock()
+
+    def _wait_for_slot(self):
+        # Blocking rate limit shared by all worker threads
+        while True:
+            with self._bucket_lock:
+                if self._bucket.try_take(1):
+                    return
+            time.sleep(0.05)
+
+    def ask(self, prompt, system_role):
+        self._wait_for_slot()
+        return self.backend({"prompt": prompt, "system_role": system_role, "max_tokens": self.max_tokens})
+
+    def load_checkpoint(self):
+        done = set()
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        done.add(json.loads(line)["key"])
+                    except (ValueError, KeyError):
+                        continue  # a half-written last line from an interrupted run
+        return done
+
+    def _mark_done(self, key):
+        with self._checkpoint_lock, open(self.checkpoint_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"key": key, "at": time.time()}) + "\n")
+
+    def _run_task(self, feature, variant, topic):
+        key = task_key(feature, variant, topic)
+        if not self.force and self.store.get(feature, topic, variant) is not None:
+            self._mark_done(key)
+            return "cached"
+        delay = 1.0
+        for attempt in range(1, self.retries + 1):
+            try:
+                value = generate(self.ask, feature, variant, topic)
+                self.store.put(feature, topic, value, variant, source="warmup")
+                self._mark_done(key)
+                return "generated"
+            except Exception as e:
+                if attempt == self.retries:
+                    self.log(f"  ✗ {key}: {e}")
+                    return "failed"
+                time.sleep(delay)
+                delay *= 2
+
+    def run(self, tasks):
+        done = set() if self.force else self.load_checkpoint()
+        todo = [t for t in tasks if task_key(*t) not in done]
+        counts = {"skipped": len(tasks) - len(todo), "cached": 0, "generated": 0, "failed": 0}
+        self.log(f"{len(tasks)} tasks, {counts['skipped']} already done, {len(todo)} to run")
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            futures = [pool.submit(self._run_task, *t) for t in todo]
+            for i, future in enumerate(as_completed(futures), 1):
+                counts[future.result()] += 1
+                if i % 10 == 0 or i == len(futures):
+                    self.log(f"  {i}/{len(futures)} finished")
+        return counts
+
+
+def make_backend(args):
+    if args.fake:
+        return lambda request: fake_model(request, latency=args.fake_latency)
+    from dotenv import load_dotenv
+    from groq import Groq
+    from llm import make_groq_backend
+    load_dotenv()
+    api_key = os.environ.get("GROQ_API_KEY")
+    if not api_key:
+        sys.exit("GROQ_API_KEY is not set (use --fake to run against the local fake model)")
+    return make_groq_backend(Groq(api_key=api_key))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-generate AI Study Buddy answers for a list of topics.")
+    parser.add_argument("topics", help="topic list: .txt (one per line) or .json")
+    parser.add_argument("--features", default=DEFAULT_FEATURES, help=f"comma-separated, from {','.join(FEATURES)}")
+    parser.add_argument("--levels", default="High School", help=f"explanation levels, from {','.join(EXPLAIN_LEVELS)}")
+    parser.add_argument("--concurrency", type=int, default=4, help="parallel model calls")
+    parser.add_argument("--rate", type=float, default=30.0, help="max model calls per minute")
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--data-dir", default=None,
+                        help=f"where the app's response store lives (default: {DATA_DIR}; a temp dir with --fake)")
+    parser.add_argument("--checkpoint", default=None, help="checkpoint file (default: <data-dir>/warmup.checkpoint)")
+    parser.add_argument("--force", action="store_true", help="regenerate answers that are already stored")
+    parser.add_argument("--fake", action="store_true", help="use the local fake model instead of Groq")
+    parser.add_argument("--fake-latency", type=float, default=0.01, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    features = [f.strip() for f in args.features.split(",") if f.strip()]
+    levels = [l.strip() for l in args.levels.split(",") if l.strip()]
+    bad = [f for f in features if f not in FEATURES] + [l for l in levels if l not in EXPLAIN_LEVELS]
+    if bad:
+        parser.error(f"unknown feature/level: {', '.join(bad)}")
+
+    if args.data_dir is None:
+        args.data_dir = tempfile.mkdtemp(prefix="study-buddy-warmup-fake-") if args.fake else DATA_DIR
+        if args.fake:
+            print(f"--fake: writing to {args.data_dir} (pass --data-dir to choose)")
+    os.makedirs(args.data_dir, exist_ok=True)
+    store = ResponseStore(os.path.join(args.data_dir, "responses.db"))
+    checkpoint = args.checkpoint or os.path.join(args.data_dir, "warmup.checkpoint")
+    runner = WarmupRunner(make_backend(args), store, checkpoint, concurrency=args.concurrency,
+                          rate_per_min=args.rate, retries=args.retries, force=args.force)
+
+    started = time.time()
+    counts = runner.run(build_tasks(read_topics(args.topics), features, levels))
+    print(f"Done in {time.time() - started:.1f}s: " + ", ".join(f"{k} {v}" for k, v in counts.items()))
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())